@@ -0,0 +1,419 @@
+from bisect import bisect_left, insort
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+
+class ExpenseFrame:
+    """Expenses as columnar arrays for vectorized analytics.
+
+    amount is float64; category and month are integer codes into the sorted
+    `categories` (category ids) and `months` (datetime64[M]) arrays, so every
+    group-by is a bincount or a sort instead of a per-row Python loop.
+    """
+
+    def __init__(self, amounts, category_ids, dates):
+        self.amount = np.asarray(amounts, dtype=np.float64)
+        self.category, self.categories = pd.factorize(np.asarray(category_ids, dtype=object), sort=True)
+        # Months span a small range, so code them with a lookup table (O(n), no sort)
+        month = np.asarray(dates, dtype="datetime64[ms]").astype("datetime64[M]").astype(np.int64)
+        if len(month):
+            first = month.min()
+            present = np.bincount(month - first) > 0
+            self.month = (np.cumsum(present) - 1)[month - first]
+            self.months = (np.flatnonzero(present) + first).astype("datetime64[M]")
+        else:
+            self.month = month
+            self.months = np.array([], dtype="datetime64[M]")
+
+    def __len__(self):
+        return len(self.amount)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build a frame from expense documents (amount, category_id, date)."""
+        count = len(records)
+        amounts = np.fromiter((r["amount"] for r in records), dtype=np.float64, count=count)
+        category_ids = [r["category_id"] for r in records]
+        dates = [r["date"] for r in records]
+        return cls(amounts, category_ids, dates)
+
+    @classmethod
+    def from_groups(cls, amounts, category_ids, months):
+        """Build a frame from one amount array per (category id, YYYY-MM month) group.
+
+        Only the group keys are coded; rows inherit their group's codes.
+        """
+        if not amounts:
+            return cls([], [], np.array([], dtype="datetime64[ms]"))
+        frame = cls.__new__(cls)
+        counts = [len(group) for group in amounts]
+        frame.amount = np.concatenate(amounts)
+        codes, frame.categories = pd.factorize(np.asarray(category_ids, dtype=object), sort=True)
+        frame.category = np.repeat(codes, counts)
+        frame.months, codes = np.unique(np.array(months, dtype="datetime64[M]"), return_inverse=True)
+        frame.month = np.repeat(codes, counts)
+        return frame
+
+    def category_code(self, category_id):
+        position = self.categories.searchsorted(category_id)
+        if position < len(self.categories) and self.categories[position] == category_id:
+            return position
+        return None
+
+    def month_code(self, month):
+        """Code of a YYYY-MM month, or None if no expense falls in it."""
+        position = self.months.searchsorted(np.datetime64(month, "M"))
+        if position < len(self.months) and self.months[position] == np.datetime64(month, "M"):
+            return position
+        return None
+
+
+async def load_expense_frame(collection, query=None):
+    """Read the matching expenses into an ExpenseFrame in bulk.
+
+    The frame only needs month resolution, so the server groups the amounts
+    by (category, month) and the client decodes one array per group instead
+    of one document per expense. Each group is a single BSON document, which
+    caps one category's month at roughly 900k expenses.
+    """
+    amounts, category_ids, months = [], [], []
+    cursor = collection.aggregate([
+        {"$match": query or {}},
+        {"$group": {
+            "_id": {"category_id": "$category_id", "month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}}},
+            "amounts": {"$push": "$amount"}
+        }}
+    ], allowDiskUse=True)
+    async for group in cursor:
+        amounts.append(np.asarray(group["amounts"], dtype=np.float64))
+        category_ids.append(group["_id"]["category_id"])
+        months.append(group["_id"]["month"])
+    return ExpenseFrame.from_groups(amounts, category_ids, months)
+
+
+def month_label(month):
+    return str(np.datetime64(month, "M"))
+
+
+def category_totals(frame):
+    """Total spent per category id."""
+    totals = np.bincount(frame.category, weights=frame.amount, minlength=len(frame.categories))
+    return dict(zip(frame.categories.tolist(), totals.tolist()))
+
+
+def monthly_totals(frame):
+    """Dense monthly series from the first to the last month, empty months as 0."""
+    if not len(frame):
+        return np.array([], dtype="datetime64[M]"), np.array([], dtype=np.float64)
+    first = frame.months[0]
+    offsets = (frame.months - first).astype(np.int64)
+    span = offsets[-1] + 1
+    totals = np.bincount(offsets[frame.month], weights=frame.amount, minlength=span)
+    return first + np.arange(span), totals
+
+
+def monthly_trends(frame, last=None):
+    """[{"month", "amount"}] for months that have expenses, oldest first."""
+    totals = np.bincount(frame.month, weights=frame.amount, minlength=len(frame.months))
+    trends = [
+        {"month": month_label(month), "amount": amount}
+        for month, amount in zip(frame.months, totals.tolist())
+    ]
+    return trends[-last:] if last else trends
+
+
+def category_month_matrix(frame):
+    """(months x categories) spending matrix over the dense month range."""
+    months, _ = monthly_totals(frame)
+    if not len(frame):
+        return months, np.zeros((0, len(frame.categories)))
+    offsets = (frame.months - frame.months[0]).astype(np.int64)[frame.month]
+    cells = offsets * len(frame.categories) + frame.category
+    matrix = np.bincount(cells, weights=frame.amount, minlength=len(months) * len(frame.categories))
+    return months, matrix.reshape(len(months), len(frame.categories))
+
+
+def rolling_mean(values, window):
+    """Trailing mean over `window` rows (fewer at the start) along axis 0."""
+    values = np.asarray(values, dtype=np.float64)
+    cumulative = np.cumsum(values, axis=0)
+    shifted = np.zeros_like(cumulative)
+    shifted[window:] = cumulative[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    if values.ndim > 1:
+        counts = counts[:, None]
+    return (cumulative - shifted) / counts
+
+
+def rolling_averages(frame, window=3):
+    """Trailing `window`-month average spending, overall and per category."""
+    months, totals = monthly_totals(frame)
+    _, matrix = category_month_matrix(frame)
+    overall = rolling_mean(totals, window)
+    per_category = rolling_mean(matrix, window)
+    return [
+        {
+            "month": month_label(month),
+            "average": average,
+            "by_category": dict(zip(frame.categories.tolist(), by_category))
+        }
+        for month, average, by_category in zip(months, overall.tolist(), per_category.tolist())
+    ]
+
+
+def category_percentiles(frame, quantiles=(0.5, 0.9, 0.99)):
+    """Per-category expense amount quantiles (linear interpolation)."""
+    if not len(frame):
+        return {}
+    order = np.lexsort((frame.amount, frame.category))
+    ordered = frame.amount[order]
+    counts = np.bincount(frame.category, minlength=len(frame.categories))
+    starts = np.cumsum(counts) - counts
+    result = {}
+    columns = {}
+    for q in quantiles:
+        position = starts + q * (counts - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        columns[q] = ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+    for code, category_id in enumerate(frame.categories.tolist()):
+        result[category_id] = {f"p{round(q * 100):g}": columns[q][code].item() for q in quantiles}
+    return result
+
+
+def budget_comparison(frame, budgets, month):
+    """Recurring budgets against the spending of one YYYY-MM month."""
+    month_code = frame.month_code(month)
+    if month_code is None:
+        spent = np.zeros(len(frame.categories))
+    else:
+        in_month = frame.month == month_code
+        spent = np.bincount(frame.category[in_month], weights=frame.amount[in_month], minlength=len(frame.categories))
+    comparison = []
+    for budget in budgets:
+        if budget.get("recurring", True):
+            code = frame.category_code(budget["category_id"])
+            comparison.append({
+                "category_id": budget["category_id"],
+                "budget": budget["amount"],
+                "actual": spent[code].item() if code is not None else 0
+            })
+    return comparison
+
+
+def daily_matrix(rollups, category_ids, days):
+    """(days x categories) spending matrix from one month's daily rollups."""
+    column = {category_id: code for code, category_id in enumerate(category_ids)}
+    matrix = np.zeros((days, len(category_ids)))
+    rollups = [r for r in rollups if r["category_id"] in column and int(r["day"][8:10]) <= days]
+    if rollups:
+        rows = np.fromiter((int(r["day"][8:10]) - 1 for r in rollups), dtype=np.int64, count=len(rollups))
+        columns = np.fromiter((column[r["category_id"]] for r in rollups), dtype=np.int64, count=len(rollups))
+        matrix[rows, columns] = [r["sum"] for r in rollups]
+    return matrix
+
+
+def with_total_column(matrix):
+    """Append the row totals as a last column."""
+    return np.column_stack([matrix, matrix.sum(axis=1)])
+
+
+def smoothing_forecast(series, horizon, alpha=0.3, beta=0.1):
+    """Holt's linear exponential smoothing of every column at once."""
+    level = series[0].copy()
+    trend = np.zeros(series.shape[1])
+    for values in series[1:]:
+        previous = level
+        level = alpha * values + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous) + (1 - beta) * trend
+    steps = np.arange(1, horizon + 1)[:, None]
+    return np.maximum(level + steps * trend, 0)
+
+
+def pace_forecast(series, horizon):
+    """Carry the month-to-date average daily spend forward."""
+    return np.repeat(series.mean(axis=0, keepdims=True), horizon, axis=0)
+
+
+FORECASTERS = {"smoothing": smoothing_forecast, "pace": pace_forecast}
+
+
+def month_forecast(series, days_in_month, budgets, method="smoothing"):
+    """Project month-end totals and budget breach days for every column.
+
+    series is the (days elapsed x n) daily spending so far and budgets a
+    length-n array (nan for no budget). Returns spent, projected and the
+    1-based day the cumulative spend first exceeds the budget (0 if never).
+    """
+    horizon = days_in_month - len(series)
+    forecast = FORECASTERS[method](series, horizon) if horizon > 0 else np.zeros((0, series.shape[1]))
+    path = np.cumsum(np.vstack([series, forecast]), axis=0)
+    crossed = path > budgets
+    breach_day = np.where(crossed.any(axis=0), crossed.argmax(axis=0) + 1, 0)
+    return path[len(series) - 1], path[-1], breach_day
+
+
+# ---- anomaly detection ----
+
+MAD_SCALE = 1.4826  # MAD to standard deviation for normally distributed amounts
+MAD_FLOOR = 0.1  # minimum MAD as a fraction of the median, so flat series still tolerate noise
+
+
+def robust_score(amount, median, mad):
+    """How many robust standard deviations `amount` lies above `median`."""
+    spread = np.maximum(np.maximum(mad, MAD_FLOOR * np.abs(median)), 0.01)
+    return (amount - median) / (MAD_SCALE * spread)
+
+
+class SlidingMedian:
+    """Median of the last `size` values; each push costs O(size), independent of history."""
+
+    def __init__(self, size):
+        self.size = size
+        self.window = deque()
+        self.ordered = []
+
+    def __len__(self):
+        return len(self.window)
+
+    def push(self, value):
+        if len(self.window) == self.size:
+            del self.ordered[bisect_left(self.ordered, self.window.popleft())]
+        self.window.append(value)
+        insort(self.ordered, value)
+
+    def median(self):
+        count = len(self.ordered)
+        if not count:
+            return None
+        middle = count // 2
+        return self.ordered[middle] if count % 2 else (self.ordered[middle - 1] + self.ordered[middle]) / 2
+
+
+class CategoryWindow:
+    """Rolling statistics of one category for scoring new expenses incrementally.
+
+    Mirrors the batch detectors: amounts are scored against the median and MAD
+    of the previous `size` amounts, days against the mean daily spend of the
+    previous `days` days.
+    """
+
+    def __init__(self, size, days):
+        self.amounts = SlidingMedian(size)
+        self.deviations = SlidingMedian(size)
+        self.days = days
+        self.daily = {}  # date ordinal -> spend
+        self.first_day = None
+        self.latest_day = None
+        self._baseline_day = None  # day the cached baseline was computed for
+        self._baseline = None
+
+    def amount_score(self, amount):
+        median = self.amounts.median()
+        if median is None:
+            return 0.0, None
+        # robust_score without numpy's per-call overhead on scalars
+        spread = max(self.deviations.median() or 0, MAD_FLOOR * abs(median), 0.01)
+        return (amount - median) / (MAD_SCALE * spread), median
+
+    def push(self, amount):
+        median = self.amounts.median()
+        if median is not None:
+            self.deviations.push(abs(amount - median))
+        self.amounts.push(amount)
+
+    def seen_on(self, day):
+        if self.first_day is None or day < self.first_day:
+            self.first_day = day
+
+    def add_to_day(self, day, amount):
+        """Add spend to a day; returns (day total before, after, baseline daily mean).
+
+        The baseline is None until the category has a full window of history.
+        """
+        self.seen_on(day)
+        before = self.daily.get(day, 0)
+        self.daily[day] = before + amount
+        if self._baseline_day is not None and self._baseline_day - self.days <= day < self._baseline_day:
+            self._baseline_day = None  # spend added inside the cached baseline's window
+        baseline = None
+        if day - self.first_day >= self.days:
+            if day != self._baseline_day:
+                self._baseline = sum(self.daily.get(day - offset, 0) for offset in range(1, self.days + 1)) / self.days
+                self._baseline_day = day
+            baseline = self._baseline
+        if self.latest_day is None or day > self.latest_day:
+            self.latest_day = day
+            for stale in [d for d in self.daily if d < day - self.days]:
+                del self.daily[stale]
+            if self._baseline_day != day:
+                self._baseline_day = None  # its window may have lost pruned days
+        return before, before + amount, baseline
+
+
+def amount_outliers(category_ids, amounts, window, min_history, threshold):
+    """Robust z-scores of each amount against its category's previous `window` amounts.
+
+    Inputs are in date order. Returns (scores, medians, flagged mask).
+    """
+    df = pd.DataFrame({"category": category_ids, "amount": np.asarray(amounts, dtype=np.float64)})
+
+    def prior_median(values):
+        return values.rolling(window, min_periods=1).median().shift()
+
+    median = df.groupby("category")["amount"].transform(prior_median)
+    df["deviation"] = (df["amount"] - median).abs()
+    mad = df.groupby("category")["deviation"].transform(prior_median).fillna(0)
+    history = df.groupby("category").cumcount()
+    scores = robust_score(df["amount"].to_numpy(), median.to_numpy(), mad.to_numpy())
+    flagged = (history.to_numpy() >= min_history) & (scores > threshold)
+    return scores, median.to_numpy(), flagged
+
+
+def duplicate_of(amounts, descriptions, days, owners=None):
+    """Index of the first identical (amount, description, day) row, or -1 per row.
+
+    Rows only match rows with the same owner when `owners` is given.
+    """
+    df = pd.DataFrame({
+        "owner": owners if owners is not None else 0,
+        "amount": amounts,
+        "description": pd.Series(descriptions, dtype=object).fillna("").str.strip().str.lower(),
+        "day": days
+    })
+    first = df.groupby(["owner", "amount", "description", "day"], sort=False).ngroup()
+    first_row = pd.Series(np.arange(len(df))).groupby(first.to_numpy()).transform("min").to_numpy()
+    return np.where(first_row < np.arange(len(df)), first_row, -1)
+
+
+def velocity_jumps(rollups, days, factor, min_history):
+    """Category days whose spend exceeds `factor` x the mean of the previous `days` days.
+
+    Works from daily rollups; returns [(day, category_id, total, baseline)].
+    """
+    if not rollups:
+        return []
+    category_ids = sorted({r["category_id"] for r in rollups})
+    column = {category_id: code for code, category_id in enumerate(category_ids)}
+    day = np.array([r["day"] for r in rollups], dtype="datetime64[D]")
+    first = day.min()
+    rows = (day - first).astype(np.int64)
+    columns = np.fromiter((column[r["category_id"]] for r in rollups), dtype=np.int64, count=len(rollups))
+    spend = np.zeros((rows.max() + 1, len(category_ids)))
+    counts = np.zeros_like(spend)
+    spend[rows, columns] = [r["sum"] for r in rollups]
+    counts[rows, columns] = [r["count"] for r in rollups]
+
+    cumulative = np.vstack([np.zeros((1, len(category_ids))), np.cumsum(spend, axis=0)])
+    previous = cumulative[:-1] - cumulative[np.maximum(np.arange(len(spend)) - days, 0)]
+    baseline = previous / days
+    history = np.cumsum(counts, axis=0) - counts
+    first_active = (counts > 0).argmax(axis=0)
+    full_window = np.arange(len(spend))[:, None] - first_active >= days
+    jumps = (spend > factor * baseline) & (baseline > 0) & (history >= min_history) & full_window
+    return [
+        (str(first + r), category_ids[c], spend[r, c].item(), baseline[r, c].item())
+        for r, c in zip(*np.nonzero(jumps))
+    ]
@@ -1,32 +1,69 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pymongo import ASCENDING, DESCENDING, TEXT, DeleteMany, DeleteOne, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pydantic import BaseModel, BeforeValidator, Field, TypeAdapter, ValidationError, field_validator
+from typing import Annotated, List, Literal, Optional
+from typing_extensions import NotRequired, TypedDict
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import bisect
+import csv
+import hashlib
+import hmac
+import io
+import json
+import logging
 import os
+import random
+import sys
+import time
+import zlib
 from dotenv import load_dotenv
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import httpx
 from dateutil.relativedelta import relativedelta
 
-load_dotenv()
+import analytics
 
-app = FastAPI()
+load_dotenv()
 
-# CORS configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+logger = logging.getLogger(__name__)
 
 # MongoDB setup
 MONGO_URL = os.environ.get('MONGO_URL')
 DB_NAME = os.environ.get('DB_NAME', 'expense-manager')
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
+LLM_API_URL = os.environ.get('LLM_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+LLM_MODEL = os.environ.get('LLM_MODEL', 'x-ai/grok-4-fast:free')
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '30'))
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '8'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '3'))
+BULK_INSERT_CHUNK_SIZE = int(os.environ.get('BULK_INSERT_CHUNK_SIZE', '5000'))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '5000'))
+METADATA_REFRESH_INTERVAL = float(os.environ.get('METADATA_REFRESH_INTERVAL', '30'))
+CHANGE_POLL_INTERVAL = float(os.environ.get('CHANGE_POLL_INTERVAL', '5'))
+INSIGHTS_CACHE_TTL = float(os.environ.get('INSIGHTS_CACHE_TTL', '3600'))
+INSIGHTS_CACHE_SIZE = int(os.environ.get('INSIGHTS_CACHE_SIZE', '128'))
+ANOMALY_WINDOW = int(os.environ.get('ANOMALY_WINDOW', '50'))
+ANOMALY_MIN_HISTORY = int(os.environ.get('ANOMALY_MIN_HISTORY', '10'))
+ANOMALY_THRESHOLD = float(os.environ.get('ANOMALY_THRESHOLD', '3.5'))
+VELOCITY_WINDOW_DAYS = int(os.environ.get('VELOCITY_WINDOW_DAYS', '28'))
+VELOCITY_FACTOR = float(os.environ.get('VELOCITY_FACTOR', '3'))
+DUPLICATE_CACHE_SIZE = int(os.environ.get('DUPLICATE_CACHE_SIZE', '10000'))
+INSIGHTS_WORKERS = int(os.environ.get('INSIGHTS_WORKERS', '4'))
+INSIGHTS_QUEUE_SIZE = int(os.environ.get('INSIGHTS_QUEUE_SIZE', '100'))
+INSIGHTS_JOB_STALE_AFTER = float(os.environ.get('INSIGHTS_JOB_STALE_AFTER', '300'))
+INSIGHTS_JOB_TTL = int(os.environ.get('INSIGHTS_JOB_TTL', '86400'))
+DEFAULT_USER_ID = os.environ.get('DEFAULT_USER_ID', 'default')
+BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', '20000'))
+TENANT_CACHE_SIZE = int(os.environ.get('TENANT_CACHE_SIZE', '1000'))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')  # /api/admin routes are disabled without one
 
 client = AsyncIOMotorClient(MONGO_URL)
 db = client[DB_NAME]
@@ -35,10 +72,179 @@ db = client[DB_NAME]
 expenses_collection = db.expenses
 categories_collection = db.categories
 budgets_collection = db.budgets
+rollups_collection = db.monthly_rollups
+daily_rollups_collection = db.daily_rollups
+data_versions_collection = db.data_versions
+sync_state_collection = db.sync_state
+anomalies_collection = db.anomalies
+insights_jobs_collection = db.insights_jobs
+
+# ==================== INDEXES ====================
+
+# Indexes required by the hot query paths, per collection. Every query is
+# scoped to one tenant, so the compound indexes lead with user_id; ids only
+# need to be unique within a tenant, since clients may choose them.
+INDEXES = {
+    expenses_collection: [
+        IndexModel([("user_id", ASCENDING), ("id", ASCENDING)], unique=True, name="user_id_unique"),
+        IndexModel([("user_id", ASCENDING), ("category_id", ASCENDING), ("date", DESCENDING)], name="user_category_date"),
+        IndexModel([("user_id", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)], name="user_date_id_desc"),
+        IndexModel([("user_id", ASCENDING), ("description", TEXT)], name="user_description_text"),
+    ],
+    categories_collection: [
+        IndexModel([("user_id", ASCENDING), ("id", ASCENDING)], unique=True, name="user_id_unique"),
+    ],
+    budgets_collection: [
+        IndexModel([("user_id", ASCENDING), ("id", ASCENDING)], unique=True, name="user_id_unique"),
+        IndexModel([("user_id", ASCENDING), ("category_id", ASCENDING)], unique=True, name="user_category_unique"),
+    ],
+    rollups_collection: [
+        IndexModel(
+            [("user_id", ASCENDING), ("month", ASCENDING), ("category_id", ASCENDING)],
+            unique=True, name="user_month_category_unique"
+        ),
+    ],
+    daily_rollups_collection: [
+        IndexModel(
+            [("user_id", ASCENDING), ("day", ASCENDING), ("category_id", ASCENDING)],
+            unique=True, name="user_day_category_unique"
+        ),
+    ],
+    anomalies_collection: [
+        IndexModel([("user_id", ASCENDING), ("date", DESCENDING)], name="user_date_desc"),
+        IndexModel([("user_id", ASCENDING), ("expense_id", ASCENDING)], name="user_expense_id"),
+    ],
+    insights_jobs_collection: [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("user_id", ASCENDING), ("data_version", ASCENDING)], unique=True, name="user_data_version_unique"),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=INSIGHTS_JOB_TTL, name="created_at_ttl"),
+    ],
+    data_versions_collection: [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+}
+
+# Indexes from the single-tenant layout, dropped in favour of the ones above
+SUPERSEDED_INDEXES = {
+    expenses_collection: ["id_unique", "category_date", "date_id_desc", "description_text"],
+    categories_collection: ["id_unique", "user_id"],
+    budgets_collection: ["id_unique", "category_id_unique"],
+    rollups_collection: ["month_category_unique"],
+    daily_rollups_collection: ["day_category_unique"],
+    anomalies_collection: ["date_desc", "expense_id"],
+    insights_jobs_collection: ["data_version_unique"],
+}
+
+# Hot queries whose plans must be index-backed: (name, collection, filter, sort)
+HOT_QUERIES = [
+    ("expense_by_id", expenses_collection, {"id": "", "user_id": ""}, None),
+    ("expenses_by_category", expenses_collection, {"user_id": "", "category_id": ""}, None),
+    ("expenses_by_date", expenses_collection, {"user_id": ""}, [("date", DESCENDING), ("id", DESCENDING)]),
+    ("expenses_in_month", expenses_collection, {"user_id": "", "date": {"$gte": datetime.min, "$lt": datetime.max}}, None),
+    ("categories_of_user", categories_collection, {"user_id": ""}, None),
+    ("category_by_id", categories_collection, {"id": "", "user_id": ""}, None),
+    ("budget_by_id", budgets_collection, {"id": "", "user_id": ""}, None),
+    ("budget_by_category", budgets_collection, {"user_id": "", "category_id": ""}, None),
+    ("rollups_for_month", rollups_collection, {"user_id": "", "month": ""}, None),
+    ("daily_rollups_in_range", daily_rollups_collection, {"user_id": "", "day": {"$gte": "", "$lte": ""}}, None),
+    ("latest_in_category", expenses_collection, {"user_id": "", "category_id": ""}, [("date", DESCENDING)]),
+    ("expenses_by_text", expenses_collection, {"user_id": "", "$text": {"$search": "x"}}, None),
+    ("anomalies_for_expense", anomalies_collection, {"user_id": "", "expense_id": ""}, None),
+]
+
+async def ensure_indexes():
+    """Create the declared indexes; safe to run on every startup."""
+    for collection, names in SUPERSEDED_INDEXES.items():
+        existing = await collection.index_information()
+        for name in names:
+            if name in existing:
+                await collection.drop_index(name)
+    for collection, indexes in INDEXES.items():
+        try:
+            await collection.create_indexes(indexes)
+        except Exception:
+            logger.exception("Failed to create indexes on %s", collection.name)
+
+def _plan_stages(plan):
+    """Flatten the stage names of a winning plan tree."""
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return [stage for stage in stages if stage]
+
+async def explain_hot_queries():
+    """Run explain() on every hot query and report which ones use a COLLSCAN."""
+    report = []
+    for name, collection, query, sort in HOT_QUERIES:
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        report.append({
+            "name": name,
+            "collection": collection.name,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages
+        })
+    return report
+
+# Application-lifetime HTTP client for the LLM provider (see lifespan)
+llm_client: Optional[httpx.AsyncClient] = None
+
+def create_llm_client():
+    """Pooled keep-alive HTTP/2 client sized to the LLM concurrency cap."""
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONCURRENCY,
+            max_keepalive_connections=LLM_MAX_CONCURRENCY
+        ),
+        headers={
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json"
+        }
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global llm_client
+    llm_client = create_llm_client()
+    await ensure_indexes()
+    try:
+        for query in await explain_hot_queries():
+            if query["collscan"]:
+                logger.warning("Query %s on %s falls back to COLLSCAN", query["name"], query["collection"])
+    except Exception:
+        logger.exception("Query plan verification failed")
+    change_feed = asyncio.create_task(follow_changes())
+    insights_workers = [asyncio.create_task(run_insights_worker()) for _ in range(INSIGHTS_WORKERS)]
+    yield
+    change_feed.cancel()
+    for worker in insights_workers:
+        worker.cancel()
+    await llm_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+# CORS configuration
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
+)
 
 # Pydantic Models
 class Category(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: Optional[str] = None  # set from the request's tenant
     name: str
     color: str = "#3b82f6"
     icon: str = "💰"
@@ -49,17 +255,24 @@ class Category(BaseModel):
 
 class Expense(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: Optional[str] = None  # set from the request's tenant
     amount: float
     category_id: str
     description: str
     date: str
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
+    @field_validator("date")
+    @classmethod
+    def normalize_date(cls, value):
+        return format_expense_date(parse_expense_date(value))
+
     class Config:
         populate_by_name = True
 
 class Budget(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: Optional[str] = None  # set from the request's tenant
     category_id: str
     amount: float
     recurring: bool = True  # Budgets are recurring by default
@@ -68,248 +281,2068 @@ class Budget(BaseModel):
     class Config:
         populate_by_name = True
 
+# ==================== TENANTS ====================
+
+# Every household is a tenant identified by the X-User-Id header; requests
+# without one belong to DEFAULT_USER_ID (the single-tenant data).
+
+def current_user(x_user_id: Optional[str] = Header(None, max_length=128, pattern=r"^[\w.@-]+$")):
+    return x_user_id or DEFAULT_USER_ID
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Deployment-wide operations are for operators, not tenants."""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+async def migrate_tenants():
+    """Assign documents written before multi-tenancy to DEFAULT_USER_ID."""
+    migrated = 0
+    for collection in (
+        expenses_collection, categories_collection, budgets_collection, rollups_collection,
+        daily_rollups_collection, anomalies_collection, insights_jobs_collection
+    ):
+        result = await collection.update_many({"user_id": {"$exists": False}}, {"$set": {"user_id": DEFAULT_USER_ID}})
+        migrated += result.modified_count
+    # Data versions used to be kept per collection only
+    await data_versions_collection.delete_many({"user_id": {"$exists": False}})
+    for collection in WATCHED_COLLECTIONS:
+        await bump_data_version(collection, DEFAULT_USER_ID)
+    return migrated
+
 # Health Check
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "service": "expense-manager"}
 
+# ==================== EXPENSE DATES ====================
+
+# Expense dates are stored as native BSON dates (UTC) so month and range
+# filters are index range scans; the API keeps exchanging them as strings.
+
+def parse_expense_date(value):
+    """Parse a YYYY-MM-DD or ISO 8601 string into an aware UTC datetime."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def format_expense_date(value):
+    """Render a stored date as YYYY-MM-DD, or full ISO 8601 if it has a time."""
+    if isinstance(value, str):
+        return value  # not migrated yet
+    if (value.hour, value.minute, value.second, value.microsecond) == (0, 0, 0, 0):
+        return value.date().isoformat()
+    return value.replace(tzinfo=timezone.utc).isoformat()
+
+def to_storage(expense_dict):
+    return {**expense_dict, "date": parse_expense_date(expense_dict["date"])}
+
+def from_storage(expense_doc):
+    return {**expense_doc, "date": format_expense_date(expense_doc["date"])}
+
+def month_bounds(month):
+    """UTC [start, end) datetimes of a YYYY-MM month."""
+    start = datetime.strptime(month, "%Y-%m").replace(tzinfo=timezone.utc)
+    return start, start + relativedelta(months=1)
+
+def date_range_filter(date_from, date_to):
+    """Range filter on the expense date, or {} when unbounded.
+    
+    A date-only 'to' includes that whole day.
+    """
+    bounds = {}
+    try:
+        if date_from:
+            bounds["$gte"] = parse_expense_date(date_from)
+        if date_to:
+            end = parse_expense_date(date_to)
+            if len(date_to) == 10:
+                bounds["$lt"] = end + timedelta(days=1)
+            else:
+                bounds["$lte"] = end
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    return {"date": bounds} if bounds else {}
+
+async def bump_expense_versions():
+    """Bump every tenant's expenses version after a deployment-wide backfill."""
+    for user_id in await expenses_collection.distinct("user_id"):
+        await bump_data_version(expenses_collection.name, user_id)
+
+async def migrate_expense_dates():
+    """Convert string dates left by older versions to BSON dates, in the database."""
+    result = await expenses_collection.update_many(
+        {"date": {"$type": "string"}},
+        [{"$set": {"date": {"$dateFromString": {"dateString": "$date", "onError": "$date"}}}}]
+    )
+    await bump_expense_versions()
+    return result.modified_count
+
+# ==================== MONTHLY ROLLUPS ====================
+
+# monthly_rollups holds one document per (user_id, month, category_id) with the
+# sum, count, min and max of its expenses, kept current by the expense write
+# paths. daily_rollups holds the sum and count per (user_id, day, category_id)
+# for forecasting.
+
+def expense_month(expense):
+    return format_expense_date(expense["date"])[:7]  # YYYY-MM
+
+def expense_day(expense):
+    return format_expense_date(expense["date"])[:10]  # YYYY-MM-DD
+
+async def add_to_rollup(expense):
+    await rollups_collection.update_one(
+        {"user_id": expense["user_id"], "month": expense_month(expense), "category_id": expense["category_id"]},
+        {
+            "$inc": {"sum": expense["amount"], "count": 1},
+            "$min": {"min": expense["amount"]},
+            "$max": {"max": expense["amount"]}
+        },
+        upsert=True
+    )
+    await daily_rollups_collection.update_one(
+        {"user_id": expense["user_id"], "day": expense_day(expense), "category_id": expense["category_id"]},
+        {"$inc": {"sum": expense["amount"], "count": 1}},
+        upsert=True
+    )
+
+async def remove_from_daily_rollup(expense):
+    key = {"user_id": expense["user_id"], "day": expense_day(expense), "category_id": expense["category_id"]}
+    rollup = await daily_rollups_collection.find_one_and_update(
+        key,
+        {"$inc": {"sum": -expense["amount"], "count": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if rollup is not None and rollup["count"] <= 0:
+        await daily_rollups_collection.delete_one(key)
+
+async def remove_from_rollup(expense):
+    await remove_from_daily_rollup(expense)
+    key = {"user_id": expense["user_id"], "month": expense_month(expense), "category_id": expense["category_id"]}
+    rollup = await rollups_collection.find_one_and_update(
+        key,
+        {"$inc": {"sum": -expense["amount"], "count": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if rollup is None:
+        return
+    if rollup["count"] <= 0:
+        await rollups_collection.delete_one(key)
+    elif expense["amount"] in (rollup["min"], rollup["max"]):
+        # The removed expense may have been the extreme; re-derive it from the
+        # bucket's own expenses (served by the category_date index)
+        month_start, next_month = month_bounds(key["month"])
+        extremes = await expenses_collection.aggregate([
+            {"$match": {
+                "user_id": key["user_id"],
+                "category_id": key["category_id"],
+                "date": {"$gte": month_start, "$lt": next_month}
+            }},
+            {"$group": {"_id": None, "min": {"$min": "$amount"}, "max": {"$max": "$amount"}}}
+        ]).to_list(length=None)
+        if extremes:
+            await rollups_collection.update_one(
+                key,
+                {"$set": {"min": extremes[0]["min"], "max": extremes[0]["max"]}}
+            )
+
+async def add_many_to_rollups(expenses, session=None):
+    """Fold a batch of new expenses into the rollups with one bulk_write each."""
+    buckets = {}
+    days = {}
+    for expense in expenses:
+        key = (expense["user_id"], expense_month(expense), expense["category_id"])
+        amount = expense["amount"]
+        day = days.setdefault((expense["user_id"], expense_day(expense), expense["category_id"]), {"sum": 0, "count": 0})
+        day["sum"] += amount
+        day["count"] += 1
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = {"sum": amount, "count": 1, "min": amount, "max": amount}
+        else:
+            bucket["sum"] += amount
+            bucket["count"] += 1
+            bucket["min"] = min(bucket["min"], amount)
+            bucket["max"] = max(bucket["max"], amount)
+    if not buckets:
+        return
+    await rollups_collection.bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "month": month, "category_id": category_id},
+            {
+                "$inc": {"sum": bucket["sum"], "count": bucket["count"]},
+                "$min": {"min": bucket["min"]},
+                "$max": {"max": bucket["max"]}
+            },
+            upsert=True
+        )
+        for (user_id, month, category_id), bucket in buckets.items()
+    ], ordered=False, session=session)
+    await daily_rollups_collection.bulk_write([
+        UpdateOne({"user_id": user_id, "day": day, "category_id": category_id}, {"$inc": bucket}, upsert=True)
+        for (user_id, day, category_id), bucket in days.items()
+    ], ordered=False, session=session)
+
+async def replace_in_rollups(removed, added, session=None):
+    """Apply batches of removed and added expenses to the rollups in a few bulk round trips."""
+    months, days = {}, {}
+    for expense in removed:
+        for buckets, period in ((months, expense_month(expense)), (days, expense_day(expense))):
+            bucket = buckets.setdefault((expense["user_id"], period, expense["category_id"]), {"sum": 0, "count": 0})
+            bucket["sum"] -= expense["amount"]
+            bucket["count"] -= 1
+    for collection, buckets, field in ((rollups_collection, months, "month"), (daily_rollups_collection, days, "day")):
+        if buckets:
+            await collection.bulk_write([
+                UpdateOne({"user_id": user_id, field: period, "category_id": category_id}, {"$inc": bucket})
+                for (user_id, period, category_id), bucket in buckets.items()
+            ], ordered=False, session=session)
+            user_ids = list({user_id for user_id, _, _ in buckets})
+            await collection.delete_many({"user_id": {"$in": user_ids}, "count": {"$lte": 0}}, session=session)
+    await add_many_to_rollups(added, session=session)
+    if not months:
+        return
+    
+    # Removed amounts may have been a bucket's min or max; re-derive them for
+    # the touched buckets with one aggregation (served by user_category_date)
+    clauses = []
+    for user_id, month, category_id in months:
+        month_start, next_month = month_bounds(month)
+        clauses.append({"user_id": user_id, "category_id": category_id, "date": {"$gte": month_start, "$lt": next_month}})
+    extremes = await expenses_collection.aggregate([
+        {"$match": {"$or": clauses}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}},
+                "category_id": "$category_id"
+            },
+            "min": {"$min": "$amount"},
+            "max": {"$max": "$amount"}
+        }}
+    ], session=session).to_list(length=None)
+    if extremes:
+        await rollups_collection.bulk_write([
+            UpdateOne(
+                {"user_id": e["_id"]["user_id"], "month": e["_id"]["month"], "category_id": e["_id"]["category_id"]},
+                {"$set": {"min": e["min"], "max": e["max"]}}
+            )
+            for e in extremes
+        ], ordered=False, session=session)
+
+# Aggregation stages that turn expenses into rollup documents
+ROLLUP_STAGES = [
+    {"$group": {
+        "_id": {
+            "user_id": "$user_id",
+            "month": {"$dateToString": {"format": "%Y-%m", "date": "$date"}},
+            "category_id": "$category_id"
+        },
+        "sum": {"$sum": "$amount"},
+        "count": {"$sum": 1},
+        "min": {"$min": "$amount"},
+        "max": {"$max": "$amount"}
+    }},
+    {"$project": {
+        "_id": 0,
+        "user_id": "$_id.user_id",
+        "month": "$_id.month",
+        "category_id": "$_id.category_id",
+        "sum": 1,
+        "count": 1,
+        "min": 1,
+        "max": 1
+    }}
+]
+
+DAILY_ROLLUP_STAGES = [
+    {"$group": {
+        "_id": {
+            "user_id": "$user_id",
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}},
+            "category_id": "$category_id"
+        },
+        "sum": {"$sum": "$amount"},
+        "count": {"$sum": 1}
+    }},
+    {"$project": {
+        "_id": 0,
+        "user_id": "$_id.user_id",
+        "day": "$_id.day",
+        "category_id": "$_id.category_id",
+        "sum": 1,
+        "count": 1
+    }}
+]
+
+async def rollups_in_range(date_filter):
+    """Rollup-shaped totals for a tenant-scoped date range filter, aggregated from the expenses."""
+    return await expenses_collection.aggregate(
+        [{"$match": date_filter}] + ROLLUP_STAGES
+    ).to_list(length=None)
+
+async def rebuild_rollups(user_id=None, category_ids=None):
+    """Recompute monthly and daily rollups from the expenses (backfill).
+    
+    Covers every tenant by default, or one tenant, optionally limited to some
+    of its categories. Safe to re-run: the result depends only on the expenses.
+    """
+    scope = {}
+    if user_id is not None:
+        scope["user_id"] = user_id
+    if category_ids is not None:
+        scope["category_id"] = {"$in": list(category_ids)}
+    for collection, stages, key in (
+        (rollups_collection, ROLLUP_STAGES, "month"),
+        (daily_rollups_collection, DAILY_ROLLUP_STAGES, "day")
+    ):
+        await collection.delete_many(scope)
+        await expenses_collection.aggregate([{"$match": scope}] + stages + [
+            {"$merge": {
+                "into": collection.name,
+                "on": ["user_id", key, "category_id"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }}
+        ]).to_list(length=None)
+    if user_id is None:
+        await bump_expense_versions()
+    else:
+        await bump_data_version(expenses_collection.name, user_id)
+    return await rollups_collection.count_documents(scope)
+
+# ==================== BUDGET VS ACTUAL ====================
+
+def group_spending(rows, amount_key="amount"):
+    """Total the amounts of expenses (or rollups) per category_id in one pass."""
+    spending = {}
+    for row in rows:
+        cat_id = row["category_id"]
+        spending[cat_id] = spending.get(cat_id, 0) + row[amount_key]
+    return spending
+
+def budget_vs_actual(budgets, spending_by_category, category_map):
+    """Join recurring budgets against already-grouped spending.
+    
+    Each row carries the budget's category document (None if the category no
+    longer exists), so callers decide how to label or skip orphaned budgets.
+    """
+    rows = []
+    for budget in budgets:
+        if budget.get("recurring", True):
+            cat_id = budget["category_id"]
+            amount = budget["amount"]
+            spent = spending_by_category.get(cat_id, 0)
+            rows.append({
+                "category_id": cat_id,
+                "category": category_map.get(cat_id),
+                "budget": amount,
+                "spent": spent,
+                "remaining": amount - spent,
+                "percentage": (spent / amount * 100) if amount > 0 else 0
+            })
+    return rows
+
+# ==================== CACHES ====================
+
+class TTLCache:
+    """LRU cache with per-entry expiry and single-flight loading.
+    
+    Concurrent get_or_load calls for a missing key share one loader call;
+    failures are not cached, so the next caller retries.
+    """
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+    
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+    
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def discard(self, key):
+        self._entries.pop(key, None)
+    
+    async def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not None:
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # Shield so one caller disconnecting does not cancel the shared load
+        return await asyncio.shield(task)
+    
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.set(key, task.result())
+
+BUDGET_PROJECTION = {"_id": 0, "merged_from": 0}  # merged_from: see merge_category_documents
+
+class MetadataCache:
+    """In-process copy of one tenant's categories and budgets.
+    
+    This worker's category/budget write endpoints update it directly (bumping
+    version); a periodic reload picks up writes made by other workers.
+    """
+    
+    def __init__(self, user_id, refresh_interval):
+        self.user_id = user_id
+        self.refresh_interval = refresh_interval
+        self.version = 0
+        self._categories = {}
+        self._budgets = {}
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+        self.data_versions = None  # category/budget versions last seen by tenant_data_versions
+    
+    def _is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval
+    
+    async def _ensure_fresh(self):
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            categories = await categories_collection.find({"user_id": self.user_id}, {"_id": 0}).to_list(length=None)
+            budgets = await budgets_collection.find({"user_id": self.user_id}, BUDGET_PROJECTION).to_list(length=None)
+            self._categories = {cat["id"]: cat for cat in categories}
+            self._budgets = {budget["id"]: budget for budget in budgets}
+            self._loaded_at = time.monotonic()
+            self.version += 1
+    
+    def invalidate(self):
+        self._loaded_at = None
+    
+    async def categories(self):
+        """Category documents keyed by id."""
+        await self._ensure_fresh()
+        return self._categories
+    
+    async def budgets(self):
+        await self._ensure_fresh()
+        return list(self._budgets.values())
+    
+    async def get_category(self, category_id):
+        """Look up a category, checking the database only on a cache miss."""
+        await self._ensure_fresh()
+        category = self._categories.get(category_id)
+        if category is None:
+            category = await categories_collection.find_one({"id": category_id, "user_id": self.user_id}, {"_id": 0})
+            if category is not None:
+                self.put_category(category)
+        return category
+    
+    def apply_change(self, event):
+        """Fold a change-feed event from any worker into the cache."""
+        collection = event["collection"]
+        if collection not in (categories_collection.name, budgets_collection.name):
+            return
+        document = event.get("document")
+        if event["operation"] in ("insert", "replace") and document:
+            document = {k: v for k, v in document.items() if k != "_id"}
+            if collection == categories_collection.name:
+                self.put_category(document)
+            else:
+                self.put_budget(document)
+        else:
+            # Updates may change the id we key on and deletes only carry _id
+            self.invalidate()
+    
+    async def budget_for_category(self, category_id):
+        await self._ensure_fresh()
+        return next((b for b in self._budgets.values() if b["category_id"] == category_id), None)
+    
+    def put_category(self, category, replaces=None):
+        if replaces is not None:
+            self._categories.pop(replaces, None)
+        self._categories[category["id"]] = category
+        self.version += 1
+    
+    def remove_category(self, category_id):
+        self._categories.pop(category_id, None)
+        self._budgets = {
+            budget_id: budget for budget_id, budget in self._budgets.items()
+            if budget["category_id"] != category_id
+        }
+        self.version += 1
+    
+    def put_budget(self, budget, replaces=None):
+        if replaces is not None:
+            self._budgets.pop(replaces, None)
+        self._budgets[budget["id"]] = budget
+        self.version += 1
+    
+    def remove_budget(self, budget_id):
+        self._budgets.pop(budget_id, None)
+        self.version += 1
+
+# Per-tenant caches, least recently used tenants dropped beyond TENANT_CACHE_SIZE
+metadata_caches = OrderedDict()
+
+def metadata_for(user_id):
+    cache = metadata_caches.get(user_id)
+    if cache is None:
+        cache = metadata_caches[user_id] = MetadataCache(user_id, refresh_interval=METADATA_REFRESH_INTERVAL)
+        if len(metadata_caches) > TENANT_CACHE_SIZE:
+            metadata_caches.popitem(last=False)
+    else:
+        metadata_caches.move_to_end(user_id)
+    return cache
+
+def apply_metadata_change(event):
+    """Route a change-feed event to its tenant's cache, or to all when unknown (deletes)."""
+    if event.get("user_id") is not None:
+        caches = [metadata_caches.get(event["user_id"])]
+    else:
+        caches = list(metadata_caches.values())
+    for cache in caches:
+        if cache is not None:
+            cache.apply_change(event)
+
+# ==================== CHANGE FEED ====================
+
+# Writes on any worker reach every worker's caches through this feed: a
+# MongoDB change stream where available, otherwise polling data_versions.
+
+WATCHED_COLLECTIONS = [expenses_collection.name, categories_collection.name, budgets_collection.name]
+CHANGE_STREAMS_UNSUPPORTED = {40573}  # standalone mongod
+TRANSACTIONS_UNSUPPORTED = {20}  # IllegalOperation: standalone mongod
+RESUME_TOKEN_LOST = {260, 280, 286}  # invalid token, history lost
+RESUME_TOKEN_SAVE_INTERVAL = 1.0
+
+# Callables receiving {"collection", "operation", "key", "document", "user_id"}
+# events; user_id is None when the event does not say (deletes)
+change_listeners = [apply_metadata_change]
+
+def publish_change(event):
+    for listener in change_listeners:
+        try:
+            listener(event)
+        except Exception:
+            logger.exception("Change listener failed for %s", event)
+
+async def bump_data_version(collection_name, user_id):
+    """Record a write to a tenant's collection (read by the polling fallback)."""
+    await data_versions_collection.update_one(
+        {"_id": f"{user_id}:{collection_name}"},
+        {"$inc": {"version": 1}, "$setOnInsert": {"user_id": user_id, "collection": collection_name}},
+        upsert=True
+    )
+    version_cache.discard(user_id)
+
+async def load_data_versions(user_id=None):
+    """{(user_id, collection): version} for one tenant, or for all."""
+    docs = await data_versions_collection.find({"user_id": user_id} if user_id else {}).to_list(length=None)
+    return {(doc.get("user_id"), doc.get("collection", doc["_id"])): doc["version"] for doc in docs}
+
+async def watch_change_stream():
+    token_doc = await sync_state_collection.find_one({"_id": "change_stream"})
+    resume_after = token_doc["token"] if token_doc else None
+    last_saved = time.monotonic()
+    async with db.watch(
+        [{"$match": {"ns.coll": {"$in": WATCHED_COLLECTIONS}}}],
+        full_document="updateLookup",
+        resume_after=resume_after
+    ) as stream:
+        async for change in stream:
+            document = change.get("fullDocument")
+            publish_change({
+                "collection": change["ns"]["coll"],
+                "operation": change["operationType"],
+                "key": change.get("documentKey", {}).get("_id"),
+                "document": document,
+                "user_id": document.get("user_id") if document else None
+            })
+            if time.monotonic() - last_saved >= RESUME_TOKEN_SAVE_INTERVAL:
+                await sync_state_collection.update_one(
+                    {"_id": "change_stream"},
+                    {"$set": {"token": stream.resume_token}},
+                    upsert=True
+                )
+                last_saved = time.monotonic()
+
+async def poll_data_versions():
+    versions = None
+    while True:
+        try:
+            current = await load_data_versions()
+        except Exception:
+            logger.exception("Polling data versions failed")
+            await asyncio.sleep(CHANGE_POLL_INTERVAL)
+            continue
+        if versions is None:
+            versions = current
+        for (user_id, collection), version in current.items():
+            if versions.get((user_id, collection)) != version:
+                publish_change({
+                    "collection": collection,
+                    "operation": "invalidate",
+                    "key": None,
+                    "document": None,
+                    "user_id": user_id
+                })
+        versions = current
+        await asyncio.sleep(CHANGE_POLL_INTERVAL)
+
+async def follow_changes():
+    """Background task feeding change events to this worker's caches."""
+    while True:
+        try:
+            await watch_change_stream()
+        except OperationFailure as e:
+            if e.code in CHANGE_STREAMS_UNSUPPORTED:
+                logger.info("Change streams unavailable, polling data versions instead")
+                await poll_data_versions()
+                return
+            if e.code in RESUME_TOKEN_LOST:
+                logger.warning("Change stream resume token is no longer valid, starting fresh")
+                await sync_state_collection.delete_one({"_id": "change_stream"})
+                for collection in WATCHED_COLLECTIONS:
+                    publish_change({
+                        "collection": collection,
+                        "operation": "invalidate",
+                        "key": None,
+                        "document": None,
+                        "user_id": None
+                    })
+                continue
+            logger.exception("Change stream failed")
+        except Exception:
+            logger.exception("Change stream failed")
+        await asyncio.sleep(CHANGE_POLL_INTERVAL)
+
+# ==================== CONDITIONAL REQUESTS ====================
+
+# Polled read endpoints send a weak ETag built from the tenant's data versions
+# and answer If-None-Match with 304 before doing any work. The versions are
+# cached per worker: dropped on local writes and change-feed events, and
+# expired after CHANGE_POLL_INTERVAL like the polling fallback, so most
+# polls need no query at all.
+
+version_cache = TTLCache(maxsize=TENANT_CACHE_SIZE, ttl=CHANGE_POLL_INTERVAL)
+
+async def tenant_data_versions(user_id):
+    """{collection: version} for one tenant."""
+    async def load():
+        loaded = await load_data_versions(user_id)
+        versions = {collection: version for (_, collection), version in loaded.items()}
+        # The ETag must never run ahead of the cached metadata a body is built
+        # from, so a category or budget version this worker has not seen yet
+        # reloads the metadata (expense writes leave it alone)
+        metadata = metadata_for(user_id)
+        seen = {name: versions.get(name, 0) for name in (categories_collection.name, budgets_collection.name)}
+        if metadata.data_versions != seen:
+            metadata.invalidate()
+            metadata.data_versions = seen
+        return versions
+    return await version_cache.get_or_load(user_id, load)
+
+def apply_version_change(event):
+    if event.get("user_id") is not None:
+        version_cache.discard(event["user_id"])
+    else:
+        version_cache.clear()
+
+change_listeners.append(apply_version_change)
+
+async def conditional_etag(request, user_id, collections, dated=False):
+    """Return (etag, 304 response or None) for a read of the given collections.
+    
+    dated adds today's date for responses that depend on the current month.
+    """
+    versions = await tenant_data_versions(user_id)
+    parts = [user_id, request.url.path, str(request.query_params)] + [f"{name}:{versions.get(name, 0)}" for name in collections]
+    if dated:
+        parts.append(datetime.now(timezone.utc).strftime("%Y-%m-%d"))
+    etag = 'W/"%s"' % hashlib.sha1("|".join(parts).encode()).hexdigest()[:20]
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in candidates or etag.removeprefix("W/") in candidates:
+            return etag, Response(status_code=304, headers={"ETag": etag})
+    return etag, None
+
+# ==================== ANOMALY DETECTION ====================
+
+# New expenses are scored as they are created against in-memory per-category
+# windows (warmed from the database once per category); scan_anomalies runs
+# the same detectors vectorized over the whole history.
+
+def anomaly_doc(kind, expense, score=None, **detail):
+    return {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "user_id": expense["user_id"],
+        "expense_id": expense.get("id"),
+        "category_id": expense["category_id"],
+        "date": expense["date"],
+        "amount": expense["amount"],
+        "description": expense.get("description"),
+        "score": score,
+        "detail": detail,
+        "detected_at": datetime.now(timezone.utc).isoformat()
+    }
+
+def duplicate_key(expense):
+    description = (expense.get("description") or "").strip().lower()
+    return expense["user_id"], expense["amount"], description, expense_day(expense)
+
+def day_ordinal(day):
+    return datetime.fromisoformat(day[:10]).toordinal()
+
+class AnomalyDetector:
+    """Scores each new expense in O(1) from rolling per-category statistics."""
+    
+    def __init__(self):
+        self._windows = {}
+        self._recent = OrderedDict()  # duplicate key -> expense id
+    
+    def reset(self):
+        self._windows.clear()
+        self._recent.clear()
+    
+    def forget_tenant(self, user_id):
+        for key in [key for key in self._windows if key[0] == user_id]:
+            del self._windows[key]
+        for key in [key for key in self._recent if key[0] == user_id]:
+            del self._recent[key]
+    
+    def forget(self, user_id, *category_ids):
+        """Drop windows whose category's expenses changed in bulk; they reload on next use."""
+        for category_id in category_ids:
+            self._windows.pop((user_id, category_id), None)
+    
+    async def window(self, user_id, category_id):
+        window = self._windows.get((user_id, category_id))
+        if window is not None:
+            return window
+        window = analytics.CategoryWindow(ANOMALY_WINDOW, VELOCITY_WINDOW_DAYS)
+        latest = await expenses_collection.find(
+            {"user_id": user_id, "category_id": category_id}, {"_id": 0, "amount": 1, "date": 1}
+        ).sort("date", DESCENDING).limit(ANOMALY_WINDOW).to_list(length=None)
+        for doc in reversed(latest):
+            window.push(doc["amount"])
+            window.seen_on(day_ordinal(format_expense_date(doc["date"])))
+        since = (datetime.now(timezone.utc) - timedelta(days=VELOCITY_WINDOW_DAYS + 1)).strftime("%Y-%m-%d")
+        async for rollup in daily_rollups_collection.find(
+            {"user_id": user_id, "day": {"$gte": since}, "category_id": category_id}
+        ):
+            window.add_to_day(day_ordinal(rollup["day"]), rollup["sum"])
+        return self._windows.setdefault((user_id, category_id), window)
+    
+    async def prepare(self, expenses):
+        """Warm the windows new expenses will be scored against; call before writing them."""
+        for user_id, category_id in {(e["user_id"], e["category_id"]) for e in expenses}:
+            await self.window(user_id, category_id)
+    
+    async def check(self, expense):
+        """Anomaly documents for an expense that was just stored; updates the statistics.
+        
+        Only call this once the write succeeded, after prepare() ran before it.
+        """
+        return self._score(await self.window(expense["user_id"], expense["category_id"]), expense)
+    
+    async def check_many(self, expenses):
+        """check() for a batch of stored expenses, in order, without a suspension per expense."""
+        anomalies = []
+        for expense in expenses:
+            window = self._windows.get((expense["user_id"], expense["category_id"]))
+            if window is None:
+                window = await self.window(expense["user_id"], expense["category_id"])
+            anomalies.extend(self._score(window, expense))
+        return anomalies
+    
+    def _score(self, window, expense):
+        seasoned = len(window.amounts) >= ANOMALY_MIN_HISTORY
+        anomalies = []
+        
+        score, median = window.amount_score(expense["amount"])
+        if seasoned and score > ANOMALY_THRESHOLD:
+            anomalies.append(anomaly_doc("amount", expense, score, median=median))
+        
+        day = expense_day(expense)
+        key = duplicate_key(expense)
+        original = self._recent.get(key)
+        if original is not None:
+            anomalies.append(anomaly_doc("duplicate", expense, duplicate_of=original))
+        else:
+            self._recent[key] = expense["id"]
+            if len(self._recent) > DUPLICATE_CACHE_SIZE:
+                self._recent.popitem(last=False)
+        
+        before, after, baseline = window.add_to_day(day_ordinal(day), expense["amount"])
+        limit = VELOCITY_FACTOR * (baseline or 0)
+        if seasoned and baseline and before <= limit < after:
+            anomalies.append(anomaly_doc(
+                "velocity",
+                {**expense, "amount": after, "date": parse_expense_date(day)},
+                after / baseline,
+                baseline=baseline
+            ))
+        
+        window.push(expense["amount"])
+        return anomalies
+
+anomaly_detector = AnomalyDetector()
+
+async def scan_tenant_anomalies(user_id):
+    """Run the detectors vectorized over one tenant's history, replacing its stored anomalies."""
+    columns = {"id": [], "user_id": [], "category_id": [], "amount": [], "description": [], "date": []}
+    cursor = expenses_collection.find({"user_id": user_id}, {"_id": 0, **{field: 1 for field in columns}})
+    async for doc in cursor.sort([("date", ASCENDING), ("id", ASCENDING)]).batch_size(EXPORT_BATCH_SIZE):
+        for field, values in columns.items():
+            values.append(doc.get(field))
+    
+    def expense_at(i):
+        return {field: values[i] for field, values in columns.items()}
+    
+    anomalies = []
+    scores, medians, flagged = analytics.amount_outliers(
+        columns["category_id"], columns["amount"], ANOMALY_WINDOW, ANOMALY_MIN_HISTORY, ANOMALY_THRESHOLD
+    )
+    for i in flagged.nonzero()[0].tolist():
+        anomalies.append(anomaly_doc("amount", expense_at(i), scores[i].item(), median=medians[i].item()))
+    
+    days = [format_expense_date(d)[:10] for d in columns["date"]]
+    originals = analytics.duplicate_of(columns["amount"], columns["description"], days)
+    for i in (originals >= 0).nonzero()[0].tolist():
+        anomalies.append(anomaly_doc("duplicate", expense_at(i), duplicate_of=columns["id"][originals[i]]))
+    
+    rollups = await daily_rollups_collection.find({"user_id": user_id}, {"_id": 0}).to_list(length=None)
+    for day, category_id, total, baseline in analytics.velocity_jumps(
+        rollups, VELOCITY_WINDOW_DAYS, VELOCITY_FACTOR, ANOMALY_MIN_HISTORY
+    ):
+        anomalies.append(anomaly_doc(
+            "velocity",
+            {"user_id": user_id, "category_id": category_id, "amount": total, "date": parse_expense_date(day)},
+            total / baseline,
+            baseline=baseline
+        ))
+    
+    await anomalies_collection.delete_many({"user_id": user_id})
+    for start in range(0, len(anomalies), BULK_INSERT_CHUNK_SIZE):
+        await anomalies_collection.insert_many(anomalies[start:start + BULK_INSERT_CHUNK_SIZE])
+    anomaly_detector.forget_tenant(user_id)
+    counts = {}
+    for anomaly in anomalies:
+        counts[anomaly["kind"]] = counts.get(anomaly["kind"], 0) + 1
+    return counts
+
+async def scan_anomalies():
+    """scan_tenant_anomalies for every tenant, one at a time so memory stays per tenant."""
+    counts = {}
+    for user_id in await expenses_collection.distinct("user_id"):
+        for kind, count in (await scan_tenant_anomalies(user_id)).items():
+            counts[kind] = counts.get(kind, 0) + count
+    return counts
+
+# ==================== ADMIN ENDPOINTS ====================
+
+@app.get("/api/admin/query-plans", dependencies=[Depends(require_admin)])
+async def get_query_plans():
+    queries = await explain_hot_queries()
+    return {
+        "queries": queries,
+        "collscans": [q["name"] for q in queries if q["collscan"]]
+    }
+
+@app.post("/api/admin/rollups/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_monthly_rollups():
+    rollup_count = await rebuild_rollups()
+    return {"message": "Rollups rebuilt successfully", "rollups": rollup_count}
+
+@app.post("/api/admin/anomalies/scan", dependencies=[Depends(require_admin)])
+async def scan_expense_anomalies():
+    counts = await scan_anomalies()
+    return {"message": "Anomaly scan completed", "anomalies": counts}
+
+@app.post("/api/admin/migrations/expense-dates", dependencies=[Depends(require_admin)])
+async def migrate_dates():
+    migrated = await migrate_expense_dates()
+    return {"message": "Expense dates migrated successfully", "migrated": migrated}
+
+@app.post("/api/admin/migrations/tenants", dependencies=[Depends(require_admin)])
+async def migrate_to_tenants():
+    migrated = await migrate_tenants()
+    return {"message": "Existing data assigned to the default tenant", "migrated": migrated}
+
 # ==================== CATEGORIES ENDPOINTS ====================
 
+# The list endpoints return stored documents as they are: they were validated
+# on write, so re-validating them through response_model only costs CPU.
+# response_model still documents the shape in the OpenAPI schema.
+
 @app.get("/api/categories", response_model=List[Category])
-async def get_categories():
-    categories = await categories_collection.find().to_list(length=None)
-    return [Category(**cat) for cat in categories]
+async def get_categories(request: Request, user_id: str = Depends(current_user)):
+    etag, not_modified = await conditional_etag(request, user_id, [categories_collection.name])
+    if not_modified:
+        return not_modified
+    categories = await metadata_for(user_id).categories()
+    return ORJSONResponse(list(categories.values()), headers={"ETag": etag})
 
 @app.post("/api/categories", response_model=Category)
-async def create_category(category: Category):
+async def create_category(category: Category, user_id: str = Depends(current_user)):
+    category.user_id = user_id
     category_dict = category.dict()
-    await categories_collection.insert_one(category_dict)
+    try:
+        await categories_collection.insert_one(category_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A category with this id already exists")
+    metadata_for(user_id).put_category(category.dict())
+    await bump_data_version(categories_collection.name, user_id)
     return category
 
 @app.put("/api/categories/{category_id}", response_model=Category)
-async def update_category(category_id: str, category: Category):
+async def update_category(category_id: str, category: Category, user_id: str = Depends(current_user)):
+    category.user_id = user_id
     category_dict = category.dict()
-    result = await categories_collection.update_one(
-        {"id": category_id},
-        {"$set": category_dict}
-    )
+    try:
+        result = await categories_collection.update_one(
+            {"id": category_id, "user_id": user_id},
+            {"$set": category_dict}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A category with this id already exists")
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    metadata_for(user_id).put_category(category_dict, replaces=category_id)
+    await bump_data_version(categories_collection.name, user_id)
     return category
 
 @app.delete("/api/categories/{category_id}")
-async def delete_category(category_id: str):
+async def delete_category(category_id: str, user_id: str = Depends(current_user)):
     # Check if category has expenses
-    expense_count = await expenses_collection.count_documents({"category_id": category_id})
+    expense_count = await expenses_collection.count_documents({"user_id": user_id, "category_id": category_id})
     if expense_count > 0:
         raise HTTPException(
             status_code=400, 
             detail=f"Cannot delete category with {expense_count} expenses"
         )
     
-    result = await categories_collection.delete_one({"id": category_id})
+    result = await categories_collection.delete_one({"id": category_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
     
     # Also delete associated budgets
-    await budgets_collection.delete_many({"category_id": category_id})
+    await budgets_collection.delete_many({"user_id": user_id, "category_id": category_id})
+    metadata_for(user_id).remove_category(category_id)
+    await bump_data_version(categories_collection.name, user_id)
+    await bump_data_version(budgets_collection.name, user_id)
     return {"message": "Category deleted successfully"}
 
+async def merge_category_documents(user_id, category_id, into, session=None):
+    """Move a category's expenses, anomalies and budget to another and delete it.
+    
+    Each step is safe to repeat, so a merge interrupted outside a transaction
+    converges when it is retried.
+    """
+    moved = await expenses_collection.update_many(
+        {"user_id": user_id, "category_id": category_id},
+        {"$set": {"category_id": into}},
+        session=session
+    )
+    await anomalies_collection.update_many(
+        {"user_id": user_id, "category_id": category_id},
+        {"$set": {"category_id": into}},
+        session=session
+    )
+    
+    # A budget on the merged category is added to the target's (guarded by
+    # merged_from so it is added once), or moves over if the target has none
+    source_budget = await budgets_collection.find_one({"user_id": user_id, "category_id": category_id}, session=session)
+    if source_budget is not None:
+        target_budget = await budgets_collection.find_one({"user_id": user_id, "category_id": into}, session=session)
+        if target_budget is None:
+            await budgets_collection.update_one(
+                {"id": source_budget["id"], "user_id": user_id},
+                {"$set": {"category_id": into}},
+                session=session
+            )
+        else:
+            await budgets_collection.update_one(
+                {"id": target_budget["id"], "user_id": user_id, "merged_from": {"$ne": source_budget["id"]}},
+                {"$inc": {"amount": source_budget["amount"]}, "$addToSet": {"merged_from": source_budget["id"]}},
+                session=session
+            )
+            await budgets_collection.delete_one({"id": source_budget["id"], "user_id": user_id}, session=session)
+    
+    await categories_collection.delete_one({"id": category_id, "user_id": user_id}, session=session)
+    return moved.modified_count
+
+@app.post("/api/categories/{category_id}/merge")
+async def merge_category(category_id: str, into: str = Query(...), user_id: str = Depends(current_user)):
+    if into == category_id:
+        raise HTTPException(status_code=400, detail="Cannot merge a category into itself")
+    metadata = metadata_for(user_id)
+    if await metadata.get_category(category_id) is None or await metadata.get_category(into) is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    
+    try:
+        async with await client.start_session() as session:
+            async with session.start_transaction():
+                moved = await merge_category_documents(user_id, category_id, into, session=session)
+    except OperationFailure as e:
+        if e.code not in TRANSACTIONS_UNSUPPORTED:
+            raise
+        # Standalone mongod: the same idempotent steps without a transaction
+        moved = await merge_category_documents(user_id, category_id, into)
+    
+    # Sweep up expenses another worker wrote to the source category while it
+    # was being merged, then recompute both categories' rollups from the
+    # expenses ($merge cannot run inside a transaction; this step is idempotent)
+    moved += (await expenses_collection.update_many(
+        {"user_id": user_id, "category_id": category_id},
+        {"$set": {"category_id": into}}
+    )).modified_count
+    await rebuild_rollups(user_id, [category_id, into])
+    
+    metadata.invalidate()
+    anomaly_detector.forget(user_id, category_id, into)
+    for collection in (categories_collection, budgets_collection):
+        await bump_data_version(collection.name, user_id)
+    return {
+        "message": "Category merged successfully",
+        "moved_expenses": moved,
+        "budget": await budgets_collection.find_one({"user_id": user_id, "category_id": into}, BUDGET_PROJECTION)
+    }
+
 # ==================== EXPENSES ENDPOINTS ====================
 
+# Keyset order for listing expenses; (date, id) is unique so pages never overlap
+EXPENSE_SORT = [("date", DESCENDING), ("id", DESCENDING)]
+EXPENSE_STREAM_BATCH_SIZE = 1000
+
+def encode_cursor(expense):
+    """Encode the (date, id) position after an expense as an opaque cursor."""
+    raw = json.dumps([expense["date"].isoformat(), expense["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    """Turn an opaque cursor back into a keyset filter."""
+    try:
+        date, expense_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        date = parse_expense_date(date)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"date": {"$lt": date}},
+        {"date": date, "id": {"$lt": expense_id}}
+    ]}
+
+async def stream_ndjson(cursor):
+    """Write each document of a Motor cursor as one NDJSON line."""
+    async for doc in cursor:
+        yield json.dumps(from_storage(doc), ensure_ascii=False) + "\n"
+
 @app.get("/api/expenses", response_model=List[Expense])
-async def get_expenses():
-    expenses = await expenses_collection.find().sort("date", -1).to_list(length=None)
-    return [Expense(**exp) for exp in expenses]
+async def get_expenses(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    user_id: str = Depends(current_user)
+):
+    query = {"user_id": user_id, **date_range_filter(date_from, date_to)}
+    if cursor:
+        query = {"$and": [query, decode_cursor(cursor)]}
+    expenses_cursor = expenses_collection.find(query, {"_id": 0}).sort(EXPENSE_SORT)
+    if limit:
+        expenses_cursor = expenses_cursor.limit(limit)
+    
+    if stream:
+        return StreamingResponse(
+            stream_ndjson(expenses_cursor.batch_size(EXPENSE_STREAM_BATCH_SIZE)),
+            media_type="application/x-ndjson"
+        )
+    
+    expenses = await expenses_cursor.to_list(length=None)
+    headers = {}
+    if limit and len(expenses) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(expenses[-1])
+    return ORJSONResponse([from_storage(exp) for exp in expenses], headers=headers)
 
 @app.post("/api/expenses", response_model=Expense)
-async def create_expense(expense: Expense):
+async def create_expense(expense: Expense, user_id: str = Depends(current_user)):
     # Verify category exists
-    category = await categories_collection.find_one({"id": expense.category_id})
+    category = await metadata_for(user_id).get_category(expense.category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    expense_dict = expense.dict()
-    await expenses_collection.insert_one(expense_dict)
+    expense.user_id = user_id
+    expense_doc = to_storage(expense.dict())
+    await anomaly_detector.prepare([expense_doc])
+    try:
+        await expenses_collection.insert_one(expense_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="An expense with this id already exists")
+    await add_to_rollup(expense_doc)
+    anomalies = await anomaly_detector.check(expense_doc)
+    if anomalies:
+        await anomalies_collection.insert_many(anomalies)
+    await bump_data_version(expenses_collection.name, user_id)
     return expense
 
+def parse_bulk_rows(body, content_type):
+    """Split a bulk upload into raw rows; unparseable rows become error strings."""
+    text = body.decode("utf-8-sig")
+    if "csv" in content_type:
+        return list(csv.DictReader(io.StringIO(text)))
+    if "ndjson" in content_type:
+        rows = []
+        for line in text.splitlines():
+            if line.strip():
+                try:
+                    rows.append(json.loads(line))
+                except ValueError as e:
+                    rows.append(f"Invalid JSON: {e}")
+        return rows
+    try:
+        rows = json.loads(text)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of expenses")
+    return rows
+
+def parse_row_date(value):
+    if not isinstance(value, str):
+        raise ValueError("Input should be a valid string")
+    return parse_expense_date(value)
+
+class ExpenseRow(TypedDict):
+    """The Expense fields of an imported row, validated without building a model."""
+    id: NotRequired[str]
+    amount: float
+    category_id: str
+    description: str
+    date: Annotated[datetime, BeforeValidator(parse_row_date)]
+    created_at: NotRequired[str]
+
+expense_row_adapter = TypeAdapter(ExpenseRow)
+
+def validate_bulk_rows(rows, category_ids, user_id):
+    """Split parsed rows into (row number, storage document) pairs and row errors.
+    
+    Rows are checked against one snapshot of the category ids and share one
+    created_at, so the per-row work stays in pydantic-core.
+    """
+    created_at = datetime.now(timezone.utc).isoformat()
+    validate = expense_row_adapter.validate_python
+    errors = []
+    valid = []
+    for row_number, row in enumerate(rows):
+        if isinstance(row, str):
+            errors.append({"row": row_number, "detail": row})
+            continue
+        if not isinstance(row, dict):
+            errors.append({"row": row_number, "detail": "Expected an object"})
+            continue
+        try:
+            doc = validate(row)
+        except ValidationError as e:
+            errors.append({"row": row_number, "detail": e.errors(include_url=False, include_context=False)})
+            continue
+        if doc["category_id"] not in category_ids:
+            errors.append({"row": row_number, "detail": "Category not found"})
+            continue
+        # Blank CSV cells count as missing
+        if not doc.get("id"):
+            doc["id"] = str(uuid.uuid4())
+        if not doc.get("created_at"):
+            doc["created_at"] = created_at
+        doc["user_id"] = user_id
+        valid.append((row_number, doc))
+    return valid, errors
+
+@app.post("/api/expenses/bulk")
+async def bulk_create_expenses(
+    request: Request,
+    chunk_size: int = Query(BULK_INSERT_CHUNK_SIZE, ge=1, le=50000),
+    user_id: str = Depends(current_user)
+):
+    rows = parse_bulk_rows(await request.body(), request.headers.get("content-type", ""))
+    
+    category_ids = set(await metadata_for(user_id).categories())
+    valid, errors = validate_bulk_rows(rows, category_ids, user_id)
+    
+    inserted = 0
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        docs = [doc for _, doc in chunk]
+        await anomaly_detector.prepare(docs)
+        failed = set()
+        try:
+            await expenses_collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details["writeErrors"]:
+                failed.add(write_error["index"])
+                errors.append({"row": chunk[write_error["index"]][0], "detail": write_error["errmsg"]})
+        written = [doc for i, doc in enumerate(docs) if i not in failed]
+        await add_many_to_rollups(written)
+        anomalies = await anomaly_detector.check_many(written)
+        if anomalies:
+            await anomalies_collection.insert_many(anomalies)
+        inserted += len(written)
+    
+    if inserted:
+        await bump_data_version(expenses_collection.name, user_id)
+    errors.sort(key=lambda error: error["row"])
+    return {
+        "inserted": inserted,
+        "failed": len(rows) - inserted,
+        "errors": errors
+    }
+
+@app.get("/api/expenses/search")
+async def search_expenses(
+    q: str = Query(..., min_length=1, max_length=200),
+    category_id: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    user_id: str = Depends(current_user)
+):
+    # Served by the tenant's description text index, ranked by relevance then recency
+    query = {"user_id": user_id, "$text": {"$search": q}, **date_range_filter(date_from, date_to)}
+    if category_id:
+        query["category_id"] = category_id
+    cursor = expenses_collection.find(query, {"_id": 0, "score": {"$meta": "textScore"}}).sort([
+        ("score", {"$meta": "textScore"}),
+        ("date", DESCENDING)
+    ]).skip(offset).limit(limit + 1)
+    results = await cursor.to_list(length=limit + 1)
+    return {
+        "results": [from_storage(expense) for expense in results[:limit]],
+        "next_offset": offset + limit if len(results) > limit else None
+    }
+
+EXPORT_FIELDS = ["id", "date", "amount", "category_id", "category_name", "description", "created_at"]
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+async def export_batches(cursor, category_names):
+    """Group cursor rows into lists of export rows with the category name joined in."""
+    batch = []
+    async for doc in cursor:
+        doc["date"] = format_expense_date(doc["date"])
+        doc["category_name"] = category_names.get(doc["category_id"], "Unknown")
+        batch.append(doc)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def encode_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    async for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+async def encode_ndjson(batches):
+    async for batch in batches:
+        yield "".join(json.dumps(doc, ensure_ascii=False) + "\n" for doc in batch).encode()
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back in chunks."""
+    
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self._position
+    
+    def flush(self):
+        pass
+    
+    def close(self):
+        self.closed = True
+    
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+async def encode_parquet(batches, pa, pq):
+    schema = pa.schema([
+        ("id", pa.string()),
+        ("date", pa.string()),
+        ("amount", pa.float64()),
+        ("category_id", pa.string()),
+        ("category_name", pa.string()),
+        ("description", pa.string()),
+        ("created_at", pa.string())
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    # One row group per batch, sent as soon as it is written
+    async for batch in batches:
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+async def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@app.get("/api/expenses/export")
+async def export_expenses(
+    request: Request,
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson|parquet)$"),
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    category_id: Optional[str] = None,
+    user_id: str = Depends(current_user)
+):
+    if export_format == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export is not available on this server")
+    
+    query = {"user_id": user_id, **date_range_filter(date_from, date_to)}
+    if category_id:
+        query["category_id"] = category_id
+    
+    categories = await metadata_for(user_id).categories()
+    category_names = {cat_id: cat["name"] for cat_id, cat in categories.items()}
+    
+    projection = {field: 1 for field in EXPORT_FIELDS if field != "category_name"}
+    projection["_id"] = 0
+    cursor = expenses_collection.find(query, projection).sort("date", ASCENDING).batch_size(EXPORT_BATCH_SIZE)
+    batches = export_batches(cursor, category_names)
+    
+    if export_format == "csv":
+        body = encode_csv(batches)
+    elif export_format == "ndjson":
+        body = encode_ndjson(batches)
+    else:
+        body = encode_parquet(batches, pa, pq)
+    
+    headers = {"Content-Disposition": f'attachment; filename="expenses.{export_format}"'}
+    # Parquet pages are already compressed
+    if export_format != "parquet" and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[export_format], headers=headers)
+
 @app.put("/api/expenses/{expense_id}", response_model=Expense)
-async def update_expense(expense_id: str, expense: Expense):
+async def update_expense(expense_id: str, expense: Expense, user_id: str = Depends(current_user)):
     # Verify category exists
-    category = await categories_collection.find_one({"id": expense.category_id})
+    category = await metadata_for(user_id).get_category(expense.category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    expense_dict = expense.dict()
-    result = await expenses_collection.update_one(
-        {"id": expense_id},
-        {"$set": expense_dict}
-    )
-    if result.modified_count == 0:
+    expense.user_id = user_id
+    expense_doc = to_storage(expense.dict())
+    try:
+        previous = await expenses_collection.find_one_and_update(
+            {"id": expense_id, "user_id": user_id},
+            {"$set": expense_doc},
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="An expense with this id already exists")
+    if previous is None:
         raise HTTPException(status_code=404, detail="Expense not found")
+    await remove_from_rollup(previous)
+    await add_to_rollup(expense_doc)
+    await anomalies_collection.delete_many({"user_id": user_id, "expense_id": expense_id})
+    await bump_data_version(expenses_collection.name, user_id)
     return expense
 
 @app.delete("/api/expenses/{expense_id}")
-async def delete_expense(expense_id: str):
-    result = await expenses_collection.delete_one({"id": expense_id})
-    if result.deleted_count == 0:
+async def delete_expense(expense_id: str, user_id: str = Depends(current_user)):
+    deleted = await expenses_collection.find_one_and_delete({"id": expense_id, "user_id": user_id})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Expense not found")
+    await remove_from_rollup(deleted)
+    await anomalies_collection.delete_many({"user_id": user_id, "expense_id": expense_id})
+    await bump_data_version(expenses_collection.name, user_id)
     return {"message": "Expense deleted successfully"}
 
 # ==================== BUDGETS ENDPOINTS ====================
 
 @app.get("/api/budgets", response_model=List[Budget])
-async def get_budgets():
-    budgets = await budgets_collection.find().to_list(length=None)
-    return [Budget(**budget) for budget in budgets]
+async def get_budgets(request: Request, user_id: str = Depends(current_user)):
+    etag, not_modified = await conditional_etag(request, user_id, [budgets_collection.name])
+    if not_modified:
+        return not_modified
+    budgets = await metadata_for(user_id).budgets()
+    return ORJSONResponse(budgets, headers={"ETag": etag})
 
 @app.post("/api/budgets", response_model=Budget)
-async def create_budget(budget: Budget):
+async def create_budget(budget: Budget, user_id: str = Depends(current_user)):
+    metadata = metadata_for(user_id)
     # Verify category exists
-    category = await categories_collection.find_one({"id": budget.category_id})
+    category = await metadata.get_category(budget.category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    # Check if budget already exists for this category (only one recurring budget per category)
-    existing = await budgets_collection.find_one({"category_id": budget.category_id})
+    # Check if budget already exists for this category (only one recurring budget
+    # per category); the unique index catches budgets this worker has not seen yet
+    existing = await metadata.budget_for_category(budget.category_id)
+    budget.user_id = user_id
+    budget_dict = budget.dict()
+    if not existing:
+        try:
+            await budgets_collection.insert_one(budget_dict)
+        except DuplicateKeyError as e:
+            if "id" in (e.details or {}).get("keyPattern", {}):
+                raise HTTPException(status_code=409, detail="A budget with this id already exists")
+            existing = True
     if existing:
         raise HTTPException(
             status_code=400, 
             detail="Budget already exists for this category. Update the existing one instead."
         )
     
-    budget_dict = budget.dict()
-    await budgets_collection.insert_one(budget_dict)
+    metadata.put_budget(budget.dict())
+    await bump_data_version(budgets_collection.name, user_id)
     return budget
 
 @app.put("/api/budgets/{budget_id}", response_model=Budget)
-async def update_budget(budget_id: str, budget: Budget):
+async def update_budget(budget_id: str, budget: Budget, user_id: str = Depends(current_user)):
     # Verify category exists
-    category = await categories_collection.find_one({"id": budget.category_id})
+    category = await metadata_for(user_id).get_category(budget.category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     
+    budget.user_id = user_id
     budget_dict = budget.dict()
-    result = await budgets_collection.update_one(
-        {"id": budget_id},
-        {"$set": budget_dict}
-    )
+    try:
+        result = await budgets_collection.update_one(
+            {"id": budget_id, "user_id": user_id},
+            {"$set": budget_dict}
+        )
+    except DuplicateKeyError as e:
+        if "id" in (e.details or {}).get("keyPattern", {}):
+            raise HTTPException(status_code=409, detail="A budget with this id already exists")
+        raise HTTPException(status_code=400, detail="Budget already exists for this category")
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Budget not found")
+    metadata_for(user_id).put_budget(budget_dict, replaces=budget_id)
+    await bump_data_version(budgets_collection.name, user_id)
     return budget
 
 @app.delete("/api/budgets/{budget_id}")
-async def delete_budget(budget_id: str):
-    result = await budgets_collection.delete_one({"id": budget_id})
+async def delete_budget(budget_id: str, user_id: str = Depends(current_user)):
+    result = await budgets_collection.delete_one({"id": budget_id, "user_id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Budget not found")
+    metadata_for(user_id).remove_budget(budget_id)
+    await bump_data_version(budgets_collection.name, user_id)
     return {"message": "Budget deleted successfully"}
 
+# ==================== BATCH ENDPOINT ====================
+
+# Collections in execution order, so expenses and budgets can reference
+# categories created earlier in the same batch
+BATCH_COLLECTIONS = {
+    "categories": (categories_collection, Category),
+    "budgets": (budgets_collection, Budget),
+    "expenses": (expenses_collection, Expense),
+}
+
+class BatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    collection: Literal["categories", "budgets", "expenses"]
+    id: Optional[str] = None  # required for update and delete
+    data: Optional[dict] = None  # the full document for create and update
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(..., max_length=BATCH_MAX_OPERATIONS)
+    transaction: bool = False
+
+def batch_write_error(collection_name, error):
+    if error.get("code") == 11000 and collection_name == "budgets":
+        return "Budget already exists for this category"
+    return error["errmsg"]
+
+@app.post("/api/batch")
+async def run_batch(batch: BatchRequest, user_id: str = Depends(current_user)):
+    operations = batch.operations
+    results = [None] * len(operations)
+    
+    def fail(index, detail):
+        results[index] = {"index": index, "status": "error", "detail": detail}
+    
+    # One prefetch per collection: the documents updates/deletes target, the
+    # tenant's category ids and which deleted categories still have expenses
+    targets = {name: [op.id for op in operations if op.collection == name and op.id] for name in BATCH_COLLECTIONS}
+    existing = {}
+    for name, ids in targets.items():
+        docs = []
+        if ids:
+            collection = BATCH_COLLECTIONS[name][0]
+            docs = await collection.find({"user_id": user_id, "id": {"$in": ids}}, {"_id": 0}).to_list(length=None)
+        existing[name] = {doc["id"]: doc for doc in docs}
+    category_ids = set(await metadata_for(user_id).categories())
+    deleted_categories = [op.id for op in operations if op.collection == "categories" and op.op == "delete"]
+    in_use = {}
+    if deleted_categories:
+        counts = await expenses_collection.aggregate([
+            {"$match": {"user_id": user_id, "category_id": {"$in": deleted_categories}}},
+            {"$group": {"_id": "$category_id", "count": {"$sum": 1}}}
+        ]).to_list(length=None)
+        in_use = {row["_id"]: row["count"] for row in counts}
+    
+    # Validate every operation and turn it into a bulk write request
+    writes = {name: [] for name in BATCH_COLLECTIONS}  # (operation index or None, request)
+    removed, added = {}, {}  # operation index -> expense taken out of / put into the rollups
+    ids = {index: op.id for index, op in enumerate(operations)}
+    created = {}  # operation index -> new expense, scored once written
+    for name, (collection, model) in BATCH_COLLECTIONS.items():
+        for index, op in enumerate(operations):
+            if op.collection != name:
+                continue
+            if op.op != "create" and op.id not in existing[name]:
+                fail(index, f"{model.__name__} not found")
+                continue
+            if op.op == "delete":
+                if name == "categories" and in_use.get(op.id):
+                    fail(index, f"Cannot delete category with {in_use[op.id]} expenses")
+                    continue
+                writes[name].append((index, DeleteOne({"id": op.id, "user_id": user_id})))
+                if name == "categories":
+                    writes["budgets"].append((None, DeleteMany({"user_id": user_id, "category_id": op.id})))
+                    category_ids.discard(op.id)
+                elif name == "expenses":
+                    removed[index] = existing[name][op.id]
+                continue
+            
+            try:
+                document = model(**(op.data or {}))
+            except ValidationError as e:
+                fail(index, e.errors(include_url=False, include_context=False))
+                continue
+            if name != "categories" and document.category_id not in category_ids:
+                fail(index, "Category not found")
+                continue
+            document.user_id = user_id
+            if op.op == "update":
+                document.id = op.id
+            doc = document.dict()
+            if name == "expenses":
+                doc = to_storage(doc)
+                added[index] = doc
+                if op.op == "update":
+                    removed[index] = existing[name][op.id]
+                else:
+                    created[index] = doc
+            if op.op == "create":
+                ids[index] = doc["id"]
+                writes[name].append((index, InsertOne(doc)))
+                if name == "categories":
+                    category_ids.add(doc["id"])
+            else:
+                writes[name].append((index, UpdateOne({"id": op.id, "user_id": user_id}, {"$set": doc})))
+    
+    def abort(message):
+        for index, result in enumerate(results):
+            if result is None or result["status"] != "error":
+                results[index] = {"index": index, "status": "rolled_back"}
+        raise HTTPException(status_code=400, detail={"message": message, "results": results})
+    
+    if batch.transaction and any(results):
+        abort("Batch rejected, nothing was written")
+    
+    async def execute(session=None):
+        for name, (collection, _) in BATCH_COLLECTIONS.items():
+            if not writes[name]:
+                continue
+            failed = {}
+            try:
+                await collection.bulk_write([request for _, request in writes[name]], ordered=False, session=session)
+            except BulkWriteError as e:
+                failed = {error["index"]: error for error in e.details["writeErrors"]}
+            for position, (index, _) in enumerate(writes[name]):
+                if index is None:
+                    continue
+                if position in failed:
+                    fail(index, batch_write_error(name, failed[position]))
+                    removed.pop(index, None)
+                    added.pop(index, None)
+                    created.pop(index, None)
+                else:
+                    results[index] = {"index": index, "status": "ok", "id": ids[index]}
+            if failed and session is not None:
+                abort("Batch rolled back")
+        
+        if removed or added:
+            await replace_in_rollups(removed.values(), added.values(), session=session)
+            changed_ids = [operations[index].id for index in removed]
+            if changed_ids:
+                await anomalies_collection.delete_many({"user_id": user_id, "expense_id": {"$in": changed_ids}}, session=session)
+    
+    await anomaly_detector.prepare(created.values())
+    
+    if batch.transaction:
+        try:
+            async with await client.start_session() as session:
+                async with session.start_transaction():
+                    await execute(session)
+        except OperationFailure as e:
+            if e.code in TRANSACTIONS_UNSUPPORTED:
+                raise HTTPException(status_code=400, detail="Transactions require a replica set or sharded cluster")
+            raise
+    else:
+        await execute()
+    
+    # Score new expenses only once they are committed
+    found = []
+    for doc in created.values():
+        found.extend(await anomaly_detector.check(doc))
+    if found:
+        await anomalies_collection.insert_many(found)
+    
+    changed = set()
+    for result in results:
+        if result["status"] == "ok":
+            op = operations[result["index"]]
+            changed.add(op.collection)
+            if op.collection == "categories" and op.op == "delete":
+                changed.add("budgets")  # its budgets were deleted with it
+    metadata = metadata_for(user_id)
+    for name in BATCH_COLLECTIONS:
+        if name in changed:
+            await bump_data_version(BATCH_COLLECTIONS[name][0].name, user_id)
+            if name != "expenses":
+                metadata.invalidate()
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
 # ==================== DASHBOARD ENDPOINT ====================
 
+def format_budget_status(row):
+    return {
+        "category": row["category"]["name"],
+        "category_icon": row["category"].get("icon", "💰"),
+        "category_color": row["category"].get("color", "#3b82f6"),
+        "budget": row["budget"],
+        "spent": row["spent"],
+        "remaining": row["remaining"],
+        "percentage": row["percentage"]
+    }
+
+def dashboard_totals(current_month_total, current_month_budget, transaction_count):
+    return {
+        "current_month_expenses": current_month_total,
+        "current_month_budget": current_month_budget,
+        "remaining_budget": current_month_budget - current_month_total,
+        "budget_utilization": (current_month_total / current_month_budget * 100) if current_month_budget > 0 else 0,
+        "transaction_count": transaction_count
+    }
+
 @app.get("/api/dashboard")
-async def get_dashboard():
+async def get_dashboard(
+    request: Request,
+    response: Response,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    user_id: str = Depends(current_user)
+):
+    etag, not_modified = await conditional_etag(request, user_id, WATCHED_COLLECTIONS, dated=True)
+    if not_modified:
+        return not_modified
+    response.headers["ETag"] = etag
+    
     # Get current month
     now = datetime.now(timezone.utc)
     current_month = now.strftime("%Y-%m")
     
-    # Get all data
-    expenses = await expenses_collection.find().to_list(length=None)
-    categories = await categories_collection.find().to_list(length=None)
-    budgets = await budgets_collection.find().to_list(length=None)
+    # Spending by category for the requested range (indexed range scan), or
+    # for the current month straight from the rollups
+    period_filter = date_range_filter(date_from, date_to)
+    if period_filter:
+        month_rollups = await rollups_in_range({"user_id": user_id, **period_filter})
+    else:
+        month_rollups = await rollups_collection.find({"user_id": user_id, "month": current_month}).to_list(length=None)
     
-    # Create category map
-    category_map = {cat["id"]: cat for cat in categories}
+    spending_by_category = group_spending(month_rollups, "sum")
+    current_month_total = sum(r["sum"] for r in month_rollups)
+    transaction_count = sum(r["count"] for r in month_rollups)
     
-    # Current month expenses
-    current_month_expenses = [
-        exp for exp in expenses 
-        if exp["date"].startswith(current_month)
-    ]
+    # Recent 5 transactions with category metadata joined in
+    recent_transactions = await expenses_collection.aggregate([
+        {"$match": {"user_id": user_id, **period_filter}},
+        {"$sort": {"date": -1}},
+        {"$limit": 5},
+        # Category ids are only unique per tenant, so the join matches on
+        # (user_id, id), which the user_id_unique index serves
+        {"$lookup": {
+            "from": categories_collection.name,
+            "let": {"category_id": "$category_id"},
+            "pipeline": [
+                {"$match": {"user_id": user_id, "$expr": {"$eq": ["$id", "$$category_id"]}}},
+                {"$project": {"_id": 0, "name": 1, "color": 1, "icon": 1}}
+            ],
+            "as": "category"
+        }},
+        {"$unwind": {"path": "$category", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "amount": 1,
+            "description": 1,
+            "date": 1,
+            "category_name": {"$ifNull": ["$category.name", "Unknown"]},
+            "category_color": {"$ifNull": ["$category.color", "#3b82f6"]},
+            "category_icon": {"$ifNull": ["$category.icon", "💰"]}
+        }}
+    ]).to_list(length=None)
+    for txn in recent_transactions:
+        txn["date"] = format_expense_date(txn["date"])
     
-    current_month_total = sum(exp["amount"] for exp in current_month_expenses)
+    # Budgets and categories from the metadata cache (budgets without a
+    # matching category are dropped, as before)
+    metadata = metadata_for(user_id)
+    budgets = await metadata.budgets()
+    category_map = await metadata.categories()
+    budget_rows = budget_vs_actual(budgets, spending_by_category, category_map)
     
     # Current month budget (sum of all recurring budgets)
-    current_month_budget = sum(b["amount"] for b in budgets if b.get("recurring", True))
-    
-    # Recent 5 transactions
-    sorted_expenses = sorted(expenses, key=lambda x: x["date"], reverse=True)[:5]
-    recent_transactions = []
-    for exp in sorted_expenses:
-        cat = category_map.get(exp["category_id"], {})
-        recent_transactions.append({
-            "id": exp["id"],
-            "amount": exp["amount"],
-            "description": exp["description"],
-            "date": exp["date"],
-            "category_name": cat.get("name", "Unknown"),
-            "category_color": cat.get("color", "#3b82f6"),
-            "category_icon": cat.get("icon", "💰")
-        })
+    current_month_budget = sum(row["budget"] for row in budget_rows)
     
     # Budget utilization by category for current month
-    budget_status = []
-    for budget in budgets:
-        if budget.get("recurring", True):
-            cat_id = budget["category_id"]
-            actual = sum(
-                exp["amount"] for exp in current_month_expenses
-                if exp["category_id"] == cat_id
-            )
-            
-            if cat_id in category_map:
-                budget_status.append({
-                    "category": category_map[cat_id]["name"],
-                    "category_icon": category_map[cat_id].get("icon", "💰"),
-                    "category_color": category_map[cat_id].get("color", "#3b82f6"),
-                    "budget": budget["amount"],
-                    "spent": actual,
-                    "remaining": budget["amount"] - actual,
-                    "percentage": (actual / budget["amount"] * 100) if budget["amount"] > 0 else 0
-                })
+    budget_status = [format_budget_status(row) for row in budget_rows if row["category"]]
     
     return {
         "current_month": current_month,
-        "current_month_expenses": current_month_total,
-        "current_month_budget": current_month_budget,
-        "remaining_budget": current_month_budget - current_month_total,
-        "budget_utilization": (current_month_total / current_month_budget * 100) if current_month_budget > 0 else 0,
+        **dashboard_totals(current_month_total, current_month_budget, transaction_count),
         "recent_transactions": recent_transactions,
-        "budget_status": budget_status,
-        "transaction_count": len(current_month_expenses)
+        "budget_status": budget_status
     }
 
+# ==================== LIVE DASHBOARD ====================
+
+RECENT_BUFFER_SIZE = 20  # recent expenses kept so deletes rarely need a refill
+WS_QUEUE_LIMIT = 100  # a client this far behind gets a fresh snapshot instead
+
+class LiveDashboard:
+    """A tenant's current-month dashboard, kept in memory while WebSocket clients listen.
+    
+    Expense change events adjust the totals, the affected budget row and the
+    recent-transactions buffer in O(1) and push only those parts as a delta.
+    Category/budget changes, feed invalidations and month rollover trigger a
+    full reload and a new snapshot.
+    """
+    
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.connections = 0  # open WebSockets, counted before subscribe() awaits
+        self._subscribers = set()
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._reload_task = None
+    
+    async def _load(self):
+        self.month = datetime.now(timezone.utc).strftime("%Y-%m")
+        start, end = month_bounds(self.month)
+        rows = await expenses_collection.find(
+            {"user_id": self.user_id, "date": {"$gte": start, "$lt": end}},
+            {"category_id": 1, "amount": 1}
+        ).to_list(length=None)
+        # _id -> (category_id, amount) for this month, to reverse updates/deletes
+        self._month_expenses = {row["_id"]: (row["category_id"], row["amount"]) for row in rows}
+        self._spending = group_spending(rows)
+        self._total = sum(self._spending.values())
+        
+        self._recent = await expenses_collection.find(
+            {"user_id": self.user_id}
+        ).sort(EXPENSE_SORT).limit(RECENT_BUFFER_SIZE).to_list(length=None)
+        self._recent_complete = len(self._recent) < RECENT_BUFFER_SIZE
+        
+        metadata = metadata_for(self.user_id)
+        self._categories = dict(await metadata.categories())
+        self._budgets = {
+            budget["category_id"]: budget
+            for budget in await metadata.budgets() if budget.get("recurring", True)
+        }
+        self._budget_total = sum(budget["amount"] for budget in self._budgets.values())
+        self._loaded = True
+    
+    def _recent_transactions(self):
+        recent = []
+        for doc in self._recent[:5]:
+            cat = self._categories.get(doc["category_id"], {})
+            recent.append({
+                "id": doc["id"],
+                "amount": doc["amount"],
+                "description": doc["description"],
+                "date": format_expense_date(doc["date"]),
+                "category_name": cat.get("name", "Unknown"),
+                "category_color": cat.get("color", "#3b82f6"),
+                "category_icon": cat.get("icon", "💰")
+            })
+        return recent
+    
+    def _budget_row(self, category_id):
+        rows = budget_vs_actual([self._budgets[category_id]], self._spending, self._categories)
+        return format_budget_status(rows[0]) if rows[0]["category"] else None
+    
+    def _totals(self):
+        return dashboard_totals(self._total, self._budget_total, len(self._month_expenses))
+    
+    def snapshot(self):
+        budget_rows = budget_vs_actual(self._budgets.values(), self._spending, self._categories)
+        return {
+            "type": "snapshot",
+            "dashboard": {
+                "current_month": self.month,
+                **self._totals(),
+                "recent_transactions": self._recent_transactions(),
+                "budget_status": [format_budget_status(row) for row in budget_rows if row["category"]]
+            }
+        }
+    
+    def _broadcast(self, message):
+        for queue in self._subscribers:
+            if queue.qsize() >= WS_QUEUE_LIMIT:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.snapshot())
+            else:
+                queue.put_nowait(message)
+    
+    async def subscribe(self):
+        async with self._lock:
+            if not self._loaded:
+                await self._load()
+            queue = asyncio.Queue()
+            queue.put_nowait(self.snapshot())
+            self._subscribers.add(queue)
+            return queue
+    
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+        if not self._subscribers:
+            # Nobody listening: drop the state rather than keep it current
+            self._loaded = False
+    
+    def _schedule_reload(self):
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.ensure_future(self._reload())
+    
+    async def _reload(self):
+        async with self._lock:
+            if not self._subscribers:
+                return
+            await self._load()
+            self._broadcast(self.snapshot())
+    
+    def _remove_month_expense(self, key, changed):
+        previous = self._month_expenses.pop(key, None)
+        if previous is not None:
+            category_id, amount = previous
+            self._spending[category_id] -= amount
+            self._total -= amount
+            changed.add(category_id)
+    
+    def _add_month_expense(self, key, doc, changed):
+        category_id, amount = doc["category_id"], doc["amount"]
+        self._month_expenses[key] = (category_id, amount)
+        self._spending[category_id] = self._spending.get(category_id, 0) + amount
+        self._total += amount
+        changed.add(category_id)
+    
+    def _update_recent(self, key, doc):
+        """Drop/insert the expense in the recent buffer; True if the top 5 changed."""
+        before = [d["_id"] for d in self._recent[:5]]
+        self._recent = [d for d in self._recent if d["_id"] != key]
+        if doc is not None:
+            # The buffer is sorted by (date, id) descending
+            sort_keys = [(d["date"], d["id"]) for d in reversed(self._recent)]
+            position = bisect.bisect(sort_keys, (doc["date"], doc["id"]))
+            # Older than everything buffered: only known to belong if the
+            # buffer holds the whole history
+            if position > 0 or self._recent_complete:
+                self._recent.insert(len(self._recent) - position, doc)
+                if len(self._recent) > RECENT_BUFFER_SIZE:
+                    self._recent.pop()
+                    self._recent_complete = False
+        return [d["_id"] for d in self._recent[:5]] != before
+    
+    def apply_change(self, event):
+        """Change listener: fold one change-feed event into the state."""
+        if not self._loaded:
+            return
+        if event["collection"] != expenses_collection.name or event["key"] is None:
+            # Category/budget changes and polling invalidations
+            self._schedule_reload()
+            return
+        if datetime.now(timezone.utc).strftime("%Y-%m") != self.month:
+            self._schedule_reload()
+            return
+        
+        key = event["key"]
+        doc = event.get("document")
+        changed = set()
+        self._remove_month_expense(key, changed)
+        if doc is not None and expense_month(doc) == self.month:
+            self._add_month_expense(key, doc, changed)
+        recent_changed = self._update_recent(key, doc)
+        if len(self._recent) < 5 and not self._recent_complete:
+            self._schedule_reload()
+            return
+        
+        if not changed and not recent_changed:
+            return
+        
+        delta = {"type": "delta", "totals": self._totals()}
+        budget_rows = [self._budget_row(cat_id) for cat_id in changed if cat_id in self._budgets]
+        budget_rows = [row for row in budget_rows if row]
+        if budget_rows:
+            delta["budget_status"] = budget_rows
+        if recent_changed:
+            delta["recent_transactions"] = self._recent_transactions()
+        self._broadcast(delta)
+
+# Per-tenant dashboards, removed when the last client leaves
+live_dashboards = {}
+
+def open_dashboard(user_id):
+    live_dashboard = live_dashboards.get(user_id)
+    if live_dashboard is None:
+        live_dashboard = live_dashboards[user_id] = LiveDashboard(user_id)
+    live_dashboard.connections += 1
+    return live_dashboard
+
+def close_dashboard(live_dashboard, queue):
+    if queue is not None:
+        live_dashboard.unsubscribe(queue)
+    live_dashboard.connections -= 1
+    if live_dashboard.connections == 0 and live_dashboards.get(live_dashboard.user_id) is live_dashboard:
+        del live_dashboards[live_dashboard.user_id]
+
+def apply_dashboard_change(event):
+    """Route a change-feed event to its tenant's dashboard, or to all when unknown (deletes)."""
+    if event.get("user_id") is not None:
+        dashboards = [live_dashboards.get(event["user_id"])]
+    else:
+        dashboards = list(live_dashboards.values())
+    for dashboard in dashboards:
+        if dashboard is not None:
+            dashboard.apply_change(event)
+
+change_listeners.append(apply_dashboard_change)
+
+async def send_dashboard_updates(websocket, queue):
+    while True:
+        await websocket.send_json(await queue.get())
+
+@app.websocket("/api/dashboard/ws")
+async def dashboard_ws(
+    websocket: WebSocket,
+    user_id: Optional[str] = Query(None, max_length=128, pattern=r"^[\w.@-]+$"),
+    x_user_id: Optional[str] = Header(None, max_length=128, pattern=r"^[\w.@-]+$")
+):
+    # Browsers cannot set headers on WebSockets, so the tenant may come as ?user_id=
+    user_id = user_id or current_user(x_user_id)
+    await websocket.accept()
+    live_dashboard = open_dashboard(user_id)
+    queue = None
+    sender = None
+    try:
+        queue = await live_dashboard.subscribe()
+        sender = asyncio.ensure_future(send_dashboard_updates(websocket, queue))
+        # Clients only listen; receiving is how a disconnect is noticed
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if sender is not None:
+            sender.cancel()
+        close_dashboard(live_dashboard, queue)
+
 # ==================== ANALYTICS ENDPOINTS ====================
 
 @app.get("/api/analytics/summary")
-async def get_analytics_summary():
-    # Get all data
-    expenses = await expenses_collection.find().to_list(length=None)
-    categories = await categories_collection.find().to_list(length=None)
-    budgets = await budgets_collection.find().to_list(length=None)
+async def get_analytics_summary(
+    request: Request,
+    response: Response,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    user_id: str = Depends(current_user)
+):
+    etag, not_modified = await conditional_etag(request, user_id, WATCHED_COLLECTIONS, dated=True)
+    if not_modified:
+        return not_modified
+    response.headers["ETag"] = etag
     
-    if not expenses:
+    # Get all data (rollups instead of raw expenses; a date range is
+    # aggregated from the expenses with an indexed range scan)
+    period_filter = date_range_filter(date_from, date_to)
+    if period_filter:
+        rollups = await rollups_in_range({"user_id": user_id, **period_filter})
+    else:
+        rollups = await rollups_collection.find({"user_id": user_id}).to_list(length=None)
+    metadata = metadata_for(user_id)
+    category_map = await metadata.categories()
+    budgets = await metadata.budgets()
+    
+    if not rollups:
         return {
             "category_spending": [],
             "monthly_trends": [],
             "budget_comparison": [],
             "average_monthly_spending": 0,
             "highest_spending_category": None,
-            "total_categories": len(categories),
+            "total_categories": len(category_map),
             "total_transactions": 0
         }
     
-    # Create category map
-    category_map = {cat["id"]: cat for cat in categories}
-    
     # Spending by category
-    spending_by_category = {}
-    for expense in expenses:
-        cat_id = expense["category_id"]
-        if cat_id in spending_by_category:
-            spending_by_category[cat_id] += expense["amount"]
-        else:
-            spending_by_category[cat_id] = expense["amount"]
+    spending_by_category = group_spending(rollups, "sum")
     
     # Format spending by category with names
     category_spending = []
@@ -332,12 +2365,12 @@ async def get_analytics_summary():
     
     # Monthly trends (last 6 months)
     monthly_spending = {}
-    for expense in expenses:
-        month = expense["date"][:7]  # YYYY-MM
+    for rollup in rollups:
+        month = rollup["month"]
         if month in monthly_spending:
-            monthly_spending[month] += expense["amount"]
+            monthly_spending[month] += rollup["sum"]
         else:
-            monthly_spending[month] = expense["amount"]
+            monthly_spending[month] = rollup["sum"]
     
     trends = sorted(
         [{"month": month, "amount": amount} for month, amount in monthly_spending.items()],
@@ -350,25 +2383,20 @@ async def get_analytics_summary():
     # Budget vs Actuals for current month
     now = datetime.now(timezone.utc)
     current_month = now.strftime("%Y-%m")
+    current_month_spending = group_spending(
+        (r for r in rollups if r["month"] == current_month), "sum"
+    )
     
-    budget_comparison = []
-    for budget in budgets:
-        if budget.get("recurring", True):
-            cat_id = budget["category_id"]
-            
-            # Calculate actual spending for this category in current month
-            actual = sum(
-                exp["amount"] for exp in expenses 
-                if exp["category_id"] == cat_id and exp["date"].startswith(current_month)
-            )
-            
-            if cat_id in category_map:
-                budget_comparison.append({
-                    "category": category_map[cat_id]["name"],
-                    "budget": budget["amount"],
-                    "actual": actual,
-                    "color": category_map[cat_id].get("color", "#3b82f6")
-                })
+    budget_comparison = [
+        {
+            "category": row["category"]["name"],
+            "budget": row["budget"],
+            "actual": row["spent"],
+            "color": row["category"].get("color", "#3b82f6")
+        }
+        for row in budget_vs_actual(budgets, current_month_spending, category_map)
+        if row["category"]
+    ]
     
     return {
         "category_spending": category_spending,
@@ -376,80 +2404,362 @@ async def get_analytics_summary():
         "budget_comparison": budget_comparison,
         "average_monthly_spending": average_monthly_spending,
         "highest_spending_category": highest_spending_category,
-        "total_categories": len(categories),
-        "total_transactions": len(expenses)
+        "total_categories": len(category_map),
+        "total_transactions": sum(r["count"] for r in rollups)
     }
 
-# ==================== AI INSIGHTS ENDPOINT ====================
+@app.get("/api/analytics/detailed")
+async def get_detailed_analytics(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    window: int = Query(3, ge=1, le=24),
+    user_id: str = Depends(current_user)
+):
+    # Columnar load of the matching expenses, then vectorized group-bys
+    frame = await analytics.load_expense_frame(
+        expenses_collection, {"user_id": user_id, **date_range_filter(date_from, date_to)}
+    )
+    metadata = metadata_for(user_id)
+    category_map = await metadata.categories()
+    budgets = await metadata.budgets()
+    current_month = datetime.now(timezone.utc).strftime("%Y-%m")
+    
+    def name(cat_id):
+        return category_map.get(cat_id, {}).get("name", "Unknown")
+    
+    percentiles = analytics.category_percentiles(frame)
+    return {
+        "category_spending": [
+            {
+                "category": name(cat_id),
+                "amount": amount,
+                "color": category_map.get(cat_id, {}).get("color", "#3b82f6"),
+                **percentiles[cat_id]
+            }
+            for cat_id, amount in analytics.category_totals(frame).items()
+        ],
+        "monthly_trends": analytics.monthly_trends(frame),
+        "rolling_averages": [
+            {
+                "month": row["month"],
+                "average": row["average"],
+                "by_category": {name(cat_id): avg for cat_id, avg in row["by_category"].items()}
+            }
+            for row in analytics.rolling_averages(frame, window)
+        ],
+        "budget_comparison": [
+            {"category": name(row["category_id"]), "budget": row["budget"], "actual": row["actual"]}
+            for row in analytics.budget_comparison(frame, budgets, current_month)
+            if row["category_id"] in category_map
+        ],
+        "total_transactions": len(frame)
+    }
 
-@app.get("/api/insights")
-async def get_ai_insights():
-    try:
-        # Get all data
-        expenses = await expenses_collection.find().to_list(length=None)
-        categories = await categories_collection.find().to_list(length=None)
-        budgets = await budgets_collection.find().to_list(length=None)
-        
-        if not expenses:
-            return {
-                "insights": "No expenses found. Start adding expenses to get AI-powered insights!",
-                "summary": {}
+# ==================== FORECAST ENDPOINT ====================
+
+@app.get("/api/forecast")
+async def get_forecast(
+    method: str = Query("smoothing", pattern="^(smoothing|pace)$"),
+    user_id: str = Depends(current_user)
+):
+    # Month-to-date daily series from the daily rollups (at most 31 x categories
+    # documents), then one vectorized projection for all categories plus the total
+    now = datetime.now(timezone.utc)
+    current_month = now.strftime("%Y-%m")
+    month_start, next_month = month_bounds(current_month)
+    days_in_month = (next_month - month_start).days
+    rollups = await daily_rollups_collection.find(
+        {"user_id": user_id, "day": {"$gte": f"{current_month}-01", "$lte": now.strftime("%Y-%m-%d")}},
+        {"_id": 0}
+    ).to_list(length=None)
+    metadata = metadata_for(user_id)
+    category_map = await metadata.categories()
+    budgets = {
+        b["category_id"]: b["amount"]
+        for b in await metadata.budgets()
+        if b.get("recurring", True)
+    }
+    
+    category_ids = sorted({r["category_id"] for r in rollups} | budgets.keys())
+    matrix = analytics.daily_matrix(rollups, category_ids, now.day)
+    series = analytics.with_total_column(matrix)
+    limits = [budgets.get(cat_id, float("nan")) for cat_id in category_ids]
+    limits.append(sum(budgets.values()) if budgets else float("nan"))
+    spent, projected, breach_day = analytics.month_forecast(series, days_in_month, limits, method)
+    
+    def forecast_row(code, budget):
+        has_budget = budget == budget  # not nan
+        return {
+            "spent": spent[code].item(),
+            "projected": projected[code].item(),
+            "budget": budget if has_budget else None,
+            "projected_remaining": budget - projected[code].item() if has_budget else None,
+            "predicted_breach_date": (
+                (month_start + timedelta(days=breach_day[code].item() - 1)).strftime("%Y-%m-%d")
+                if breach_day[code] else None
+            )
+        }
+    
+    return {
+        "month": current_month,
+        "method": method,
+        "days_elapsed": now.day,
+        "days_in_month": days_in_month,
+        "overall": forecast_row(len(category_ids), limits[-1]),
+        "categories": [
+            {
+                "category_id": cat_id,
+                "category": category_map.get(cat_id, {}).get("name", "Unknown"),
+                "color": category_map.get(cat_id, {}).get("color", "#3b82f6"),
+                **forecast_row(code, limits[code])
             }
-        
-        # Create category map
-        category_map = {cat["id"]: cat["name"] for cat in categories}
-        
-        # Prepare data summary for AI
-        total_expenses = sum(exp["amount"] for exp in expenses)
-        
-        spending_by_category = {}
-        for expense in expenses:
-            cat_name = category_map.get(expense["category_id"], "Unknown")
-            if cat_name in spending_by_category:
-                spending_by_category[cat_name] += expense["amount"]
-            else:
-                spending_by_category[cat_name] = expense["amount"]
-        
-        # Current month data
-        now = datetime.now(timezone.utc)
-        current_month = now.strftime("%Y-%m")
-        current_month_expenses = [
-            exp for exp in expenses if exp["date"].startswith(current_month)
+            for code, cat_id in enumerate(category_ids)
         ]
-        current_month_total = sum(exp["amount"] for exp in current_month_expenses)
-        
-        # Budget data
-        total_budget = sum(b["amount"] for b in budgets if b.get("recurring", True))
-        budget_info = []
-        for budget in budgets:
-            if budget.get("recurring", True):
-                cat_name = category_map.get(budget["category_id"], "Unknown")
-                actual = sum(
-                    exp["amount"] for exp in current_month_expenses 
-                    if exp["category_id"] == budget["category_id"]
-                )
-                budget_info.append({
-                    "category": cat_name,
-                    "budget": budget["amount"],
-                    "actual": actual
-                })
-        
-        # Create prompt for AI
-        prompt = f"""Analyze this expense data (amounts in Indian Rupees ₹) and provide clear, actionable insights:
+    }
+
+# ==================== ANOMALIES ENDPOINT ====================
+
+@app.post("/api/anomalies/scan")
+async def scan_expense_anomalies_for_tenant(user_id: str = Depends(current_user)):
+    counts = await scan_tenant_anomalies(user_id)
+    return {"message": "Anomaly scan completed", "anomalies": counts}
+
+@app.get("/api/anomalies")
+async def get_anomalies(
+    kind: Optional[str] = Query(None, pattern="^(amount|duplicate|velocity)$"),
+    category_id: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    limit: int = Query(100, ge=1, le=1000),
+    user_id: str = Depends(current_user)
+):
+    query = {"user_id": user_id, **date_range_filter(date_from, date_to)}
+    if kind:
+        query["kind"] = kind
+    if category_id:
+        query["category_id"] = category_id
+    anomalies = await anomalies_collection.find(query, {"_id": 0}).sort("date", DESCENDING).to_list(length=limit)
+    return [from_storage(anomaly) for anomaly in anomalies]
+
+# ==================== AI INSIGHTS ENDPOINT ====================
+
+# Completions keyed by a hash of the prompt, which captures every input
+insights_cache = TTLCache(maxsize=INSIGHTS_CACHE_SIZE, ttl=INSIGHTS_CACHE_TTL)
+
+# Caps in-flight LLM calls across all requests on this worker
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+async def post_to_llm(payload):
+    """POST to the LLM provider, retrying 429/5xx with jittered exponential backoff."""
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        async with llm_semaphore:
+            response = await llm_client.post(LLM_API_URL, json=payload)
+        if response.status_code not in RETRYABLE_STATUS_CODES or attempt == LLM_MAX_RETRIES:
+            return response
+        await asyncio.sleep(random.uniform(0, 0.5 * 2 ** attempt))
+
+async def stream_insights(prompt):
+    """Yield completion tokens from the LLM provider's streaming API.
+    
+    429/5xx responses are retried like post_to_llm, but only before the
+    first token, so a stream is never replayed.
+    """
+    payload = {
+        "model": LLM_MODEL,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ],
+        "stream": True
+    }
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        async with llm_semaphore:
+            async with llm_client.stream("POST", LLM_API_URL, json=payload) as response:
+                if response.status_code == 200:
+                    async for line in response.aiter_lines():
+                        # Skip blank lines and SSE comments (keep-alives)
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            return
+                        delta = json.loads(data)["choices"][0].get("delta", {})
+                        if delta.get("content"):
+                            yield delta["content"]
+                    return
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt == LLM_MAX_RETRIES:
+                    await response.aread()
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"AI service error: {response.text}"
+                    )
+        await asyncio.sleep(random.uniform(0, 0.5 * 2 ** attempt))
+
+async def request_insights(prompt):
+    """Ask the LLM provider for insights on a prompt."""
+    response = await post_to_llm({
+        "model": LLM_MODEL,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    })
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"AI service error: {response.text}"
+        )
+    
+    result = response.json()
+    return result["choices"][0]["message"]["content"]
+
+NO_EXPENSES_INSIGHTS = "No expenses found. Start adding expenses to get AI-powered insights!"
+
+TOP_MERCHANTS = 5
+
+async def top_merchants(user_id, month):
+    """Largest descriptions by spend in a month (an indexed range scan of that month only)."""
+    month_start, next_month = month_bounds(month)
+    return await expenses_collection.aggregate([
+        {"$match": {"user_id": user_id, "date": {"$gte": month_start, "$lt": next_month}}},
+        {"$group": {
+            "_id": {"$toLower": {"$trim": {"input": "$description"}}},
+            "amount": {"$sum": "$amount"},
+            "count": {"$sum": 1}
+        }},
+        {"$sort": {"amount": -1}},
+        {"$limit": TOP_MERCHANTS},
+        {"$project": {"_id": 0, "merchant": "$_id", "amount": 1, "count": 1}}
+    ]).to_list(length=None)
+
+async def insights_snapshot(user_id):
+    """Compact statistics the insights prompt is built from, or None without data."""
+    # Monthly rollups (months x categories documents) and cached metadata,
+    # so the cost does not grow with the number of expenses
+    rollups = await rollups_collection.find({"user_id": user_id}, {"_id": 0}).to_list(length=None)
+    if not rollups:
+        return None
+    metadata = metadata_for(user_id)
+    category_map = await metadata.categories()
+    budgets = await metadata.budgets()
+    
+    def name(cat_id):
+        return category_map.get(cat_id, {}).get("name", "Unknown")
+    
+    now = datetime.now(timezone.utc)
+    current_month = now.strftime("%Y-%m")
+    month_start, next_month = month_bounds(current_month)
+    previous_month = (month_start - relativedelta(months=1)).strftime("%Y-%m")
+    days_in_month = (next_month - month_start).days
+    # Whole days (today included), so the prompt and its cache key only change
+    # with the data or the date
+    elapsed = now.day / days_in_month
+    
+    current = [r for r in rollups if r["month"] == current_month]
+    previous = [r for r in rollups if r["month"] == previous_month]
+    current_spending = group_spending(current, "sum")
+    previous_spending = group_spending(previous, "sum")
+    
+    spending_by_category = {}
+    for cat_id, amount in group_spending(rollups, "sum").items():
+        spending_by_category[name(cat_id)] = spending_by_category.get(name(cat_id), 0) + amount
+    
+    month_over_month = sorted(
+        (
+            {
+                "category": name(cat_id),
+                "current": current_spending.get(cat_id, 0),
+                "previous": previous_spending.get(cat_id, 0),
+                "change": current_spending.get(cat_id, 0) - previous_spending.get(cat_id, 0)
+            }
+            for cat_id in current_spending.keys() | previous_spending.keys()
+        ),
+        key=lambda row: abs(row["change"]),
+        reverse=True
+    )
+    
+    # Burn rate: share of the budget spent relative to the share of the month elapsed
+    budget_burn = [
+        {
+            "category": row["category"]["name"] if row["category"] else "Unknown",
+            "budget": row["budget"],
+            "spent": row["spent"],
+            "burn_rate": row["spent"] / row["budget"] / elapsed if row["budget"] else None,
+            "projected": row["spent"] / elapsed
+        }
+        for row in budget_vs_actual(budgets, current_spending, category_map)
+    ]
+    
+    return {
+        "month": current_month,
+        "previous_month": previous_month,
+        "days_elapsed": now.day,
+        "days_in_month": days_in_month,
+        "total_expenses": sum(r["sum"] for r in rollups),
+        "total_transactions": sum(r["count"] for r in rollups),
+        "spending_by_category": spending_by_category,
+        "current_month_total": sum(r["sum"] for r in current),
+        "current_month_count": sum(r["count"] for r in current),
+        "previous_month_total": sum(r["sum"] for r in previous),
+        "month_over_month": month_over_month,
+        "top_merchants": await top_merchants(user_id, current_month),
+        "budget_burn": budget_burn
+    }
 
-Current Month ({current_month}):
-- Expenses: ₹{current_month_total:.2f}
+def format_change(current, previous):
+    if not previous:
+        return "new" if current else "no change"
+    return f"{(current - previous) / previous:+.0%}"
+
+async def build_insights_context(user_id):
+    """Build the LLM prompt and the locally computed summary, or None without data."""
+    snapshot = await insights_snapshot(user_id)
+    if snapshot is None:
+        return None
+    
+    total_budget = sum(b["budget"] for b in snapshot["budget_burn"])
+    category_lines = [f"- {cat}: ₹{amt:.2f}" for cat, amt in snapshot["spending_by_category"].items()]
+    change_lines = [
+        f"- {row['category']}: ₹{row['current']:.2f} vs ₹{row['previous']:.2f} "
+        f"({format_change(row['current'], row['previous'])})"
+        for row in snapshot["month_over_month"]
+    ]
+    merchant_lines = [
+        f"- {m['merchant'] or 'No description'}: ₹{m['amount']:.2f} over {m['count']} transactions"
+        for m in snapshot["top_merchants"]
+    ]
+    budget_lines = [
+        f"- {b['category']}: Budget ₹{b['budget']:.2f}, Current Month Spent ₹{b['spent']:.2f}, "
+        f"projected ₹{b['projected']:.2f} at month end"
+        + (f", burning {b['burn_rate']:.1f}x the sustainable pace" if b["burn_rate"] is not None else "")
+        for b in snapshot["budget_burn"]
+    ]
+    
+    # Create prompt for AI
+    prompt = f"""Analyze this expense data (amounts in Indian Rupees ₹) and provide clear, actionable insights:
+
+Current Month ({snapshot['month']}, day {snapshot['days_elapsed']} of {snapshot['days_in_month']}):
+- Expenses: ₹{snapshot['current_month_total']:.2f}
 - Budget: ₹{total_budget:.2f}
-- Transactions: {len(current_month_expenses)}
+- Transactions: {snapshot['current_month_count']}
+- Previous month ({snapshot['previous_month']}): ₹{snapshot['previous_month_total']:.2f} \
+({format_change(snapshot['current_month_total'], snapshot['previous_month_total'])})
 
-Total Expenses (All Time): ₹{total_expenses:.2f}
-Total Transactions: {len(expenses)}
+Total Expenses (All Time): ₹{snapshot['total_expenses']:.2f}
+Total Transactions: {snapshot['total_transactions']}
 
 Spending by Category:
-{chr(10).join([f'- {cat}: ₹{amt:.2f}' for cat, amt in spending_by_category.items()])}
+{chr(10).join(category_lines)}
+
+Month-over-Month by Category:
+{chr(10).join(change_lines) if change_lines else 'No spending this or last month'}
+
+Top Merchants This Month:
+{chr(10).join(merchant_lines) if merchant_lines else 'No expenses this month'}
 
 Recurring Monthly Budgets:
-{chr(10).join([f"- {b['category']}: Budget ₹{b['budget']:.2f}, Current Month Spent ₹{b['actual']:.2f}" for b in budget_info]) if budget_info else 'No budgets set'}
+{chr(10).join(budget_lines) if budget_lines else 'No budgets set'}
 
 Provide:
 1. Key spending patterns and insights
@@ -459,47 +2769,202 @@ Provide:
 5. Financial health assessment
 
 Keep the response concise, actionable, and focused on the current month."""
+    
+    return {
+        "prompt": prompt,
+        "summary": {
+            "total_expenses": snapshot["total_expenses"],
+            "current_month_expenses": snapshot["current_month_total"],
+            "current_month_budget": total_budget,
+            "num_transactions": snapshot["total_transactions"],
+            "categories": len(snapshot["spending_by_category"]),
+            "budgets_set": len(snapshot["budget_burn"])
+        }
+    }
+
+def insights_cache_key(user_id, prompt):
+    return user_id, hashlib.sha256(prompt.encode()).hexdigest()
+
+@app.get("/api/insights")
+async def get_ai_insights(user_id: str = Depends(current_user)):
+    try:
+        context = await build_insights_context(user_id)
+        if context is None:
+            return {"insights": NO_EXPENSES_INSIGHTS, "summary": {}}
         
-        # Call OpenRouter API
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "x-ai/grok-4-fast:free",
-                    "messages": [
-                        {"role": "user", "content": prompt}
-                    ]
-                }
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=500, 
-                    detail=f"AI service error: {response.text}"
-                )
-            
-            result = response.json()
-            insights_text = result["choices"][0]["message"]["content"]
+        # Call OpenRouter API (cached; identical concurrent prompts share one call)
+        prompt = context["prompt"]
+        insights_text = await insights_cache.get_or_load(
+            insights_cache_key(user_id, prompt), lambda: request_insights(prompt)
+        )
         
         return {
             "insights": insights_text,
-            "summary": {
-                "total_expenses": total_expenses,
-                "current_month_expenses": current_month_total,
-                "current_month_budget": total_budget,
-                "num_transactions": len(expenses),
-                "categories": len(spending_by_category),
-                "budgets_set": len(budget_info)
-            }
+            "summary": context["summary"]
         }
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating insights: {str(e)}")
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def insights_events(user_id):
+    """Yield the summary, then completion tokens as they arrive, as SSE events."""
+    try:
+        context = await build_insights_context(user_id)
+        if context is None:
+            yield sse_event("summary", {})
+            yield sse_event("token", {"content": NO_EXPENSES_INSIGHTS})
+            yield sse_event("done", {})
+            return
+        
+        yield sse_event("summary", context["summary"])
+        
+        prompt = context["prompt"]
+        key = insights_cache_key(user_id, prompt)
+        cached = insights_cache.get(key)
+        if cached is not None:
+            yield sse_event("token", {"content": cached})
+        else:
+            tokens = []
+            async for token in stream_insights(prompt):
+                tokens.append(token)
+                yield sse_event("token", {"content": token})
+            insights_cache.set(key, "".join(tokens))
+        yield sse_event("done", {})
+    
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        yield sse_event("error", {"detail": f"Error generating insights: {detail}"})
+
+@app.get("/api/insights/stream")
+async def stream_ai_insights(user_id: str = Depends(current_user)):
+    return StreamingResponse(
+        insights_events(user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ==================== INSIGHTS JOBS ====================
+
+# Insights generated off the request path: jobs are persisted in
+# insights_jobs and run by a bounded pool of workers on this process.
+# One job exists per data version, so repeated submissions share it.
+
+insights_queue = asyncio.Queue(maxsize=INSIGHTS_QUEUE_SIZE)
+
+async def insights_data_version(user_id):
+    """Key identifying the inputs of a tenant's insights prompt."""
+    versions = await load_data_versions(user_id)
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")  # the prompt includes the day of month
+    return ":".join([day] + [str(versions.get((user_id, name), 0)) for name in WATCHED_COLLECTIONS])
+
+def format_job(job):
+    job = {key: value for key, value in job.items() if key != "_id"}
+    for field in ("created_at", "updated_at"):
+        job[field] = job[field].replace(tzinfo=timezone.utc).isoformat()
+    return job
+
+async def set_job_state(job_id, status, **fields):
+    await insights_jobs_collection.update_one(
+        {"id": job_id},
+        {"$set": {"status": status, "updated_at": datetime.now(timezone.utc), **fields}}
+    )
+
+async def run_insights_job(job_id, user_id):
+    await set_job_state(job_id, "running")
+    try:
+        context = await build_insights_context(user_id)
+        if context is None:
+            result = {"insights": NO_EXPENSES_INSIGHTS, "summary": {}}
+        else:
+            prompt = context["prompt"]
+            insights_text = await insights_cache.get_or_load(
+                insights_cache_key(user_id, prompt), lambda: request_insights(prompt)
+            )
+            result = {"insights": insights_text, "summary": context["summary"]}
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        await set_job_state(job_id, "failed", error=f"Error generating insights: {detail}")
+    else:
+        await set_job_state(job_id, "completed", result=result)
+
+async def run_insights_worker():
+    while True:
+        job_id, user_id = await insights_queue.get()
+        try:
+            await run_insights_job(job_id, user_id)
+        except Exception:
+            logger.exception("Insights job %s failed", job_id)
+        finally:
+            insights_queue.task_done()
+
+def job_needs_run(job, now):
+    if job["status"] == "failed":
+        return True
+    # Queued or running on a worker that has since died
+    stale = now - job["updated_at"].replace(tzinfo=timezone.utc) > timedelta(seconds=INSIGHTS_JOB_STALE_AFTER)
+    return job["status"] in ("queued", "running") and stale
+
+@app.post("/api/insights/jobs", status_code=202)
+async def submit_insights_job(user_id: str = Depends(current_user)):
+    now = datetime.now(timezone.utc)
+    new_id = str(uuid.uuid4())
+    data_version = await insights_data_version(user_id)
+    try:
+        job = await insights_jobs_collection.find_one_and_update(
+            {"user_id": user_id, "data_version": data_version},
+            {"$setOnInsert": {
+                "id": new_id,
+                "user_id": user_id,
+                "data_version": data_version,
+                "status": "queued",
+                "created_at": now,
+                "updated_at": now
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A concurrent submission inserted it first
+        job = await insights_jobs_collection.find_one({"user_id": user_id, "data_version": data_version})
+    
+    enqueue = job["id"] == new_id
+    if not enqueue and job_needs_run(job, now):
+        # Claim the retry only if no other request did in the meantime
+        retried = await insights_jobs_collection.update_one(
+            {"id": job["id"], "updated_at": job["updated_at"]},
+            {"$set": {"status": "queued", "updated_at": now}, "$unset": {"error": ""}}
+        )
+        enqueue = retried.modified_count == 1
+        if enqueue:
+            job.update(status="queued", updated_at=now)
+            job.pop("error", None)
+    if enqueue:
+        try:
+            insights_queue.put_nowait((job["id"], user_id))
+        except asyncio.QueueFull:
+            await set_job_state(job["id"], "failed", error="Insights queue is full")
+            raise HTTPException(status_code=503, detail="Insights queue is full, try again later")
+    return format_job(job)
+
+@app.get("/api/insights/jobs/{job_id}")
+async def get_insights_job(job_id: str, user_id: str = Depends(current_user)):
+    job = await insights_jobs_collection.find_one({"id": job_id, "user_id": user_id})
+    if job is None:
+        raise HTTPException(status_code=404, detail="Insights job not found")
+    return format_job(job)
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    if sys.argv[1:] == ["rebuild-rollups"]:
+        print(f"Rebuilt {asyncio.run(rebuild_rollups())} rollups")
+    elif sys.argv[1:] == ["migrate-dates"]:
+        print(f"Migrated {asyncio.run(migrate_expense_dates())} expense dates")
+    elif sys.argv[1:] == ["migrate-tenants"]:
+        print(f"Assigned {asyncio.run(migrate_tenants())} documents to the default tenant")
+    elif sys.argv[1:] == ["scan-anomalies"]:
+        print(f"Found anomalies: {asyncio.run(scan_anomalies())}")
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8001)
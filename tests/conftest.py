@@ -0,0 +1,95 @@
+import asyncio
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+
+def _bind(value, variables):
+    """Substitute $$variables of a $lookup pipeline with their values."""
+    if isinstance(value, str) and value.startswith("$$") and value[2:] in variables:
+        return variables[value[2:]]
+    if isinstance(value, dict):
+        return {key: _bind(item, variables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_bind(item, variables) for item in value]
+    return value
+
+
+def _lookup_stage(original):
+    """mongomock's $lookup plus the let/pipeline form it does not implement."""
+    from mongomock import aggregate
+
+    def handle(in_collection, database, options):
+        if "pipeline" not in options:
+            return original(in_collection, database, options)
+        foreign = list(database.get_collection(options["from"]).find())
+        for doc in in_collection:
+            variables = {name: doc.get(field[1:]) for name, field in options.get("let", {}).items()}
+            pipeline = _bind(options["pipeline"], variables)
+            doc[options["as"]] = list(aggregate.process_pipeline(copy.deepcopy(foreign), database, pipeline, None))
+        return in_collection
+
+    return handle
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """A TestClient for the app backed by a fresh in-memory database.
+
+    mongomock has no change streams, so the app falls back to polling data
+    versions, as it does against a standalone mongod.
+    """
+    from fastapi.testclient import TestClient
+    from mongomock import aggregate
+    from mongomock_motor import AsyncMongoMockClient
+    from pymongo.errors import OperationFailure
+
+    import server
+
+    handlers = aggregate._PIPELINE_HANDLERS
+    monkeypatch.setitem(handlers, "$lookup", _lookup_stage(handlers["$lookup"]))
+
+    mock = AsyncMongoMockClient()
+    db = mock[server.DB_NAME]
+    monkeypatch.setattr(server, "client", mock)
+    monkeypatch.setattr(server, "db", db)
+    for name in dir(server):
+        if name.endswith("_collection"):
+            monkeypatch.setattr(server, name, db[getattr(server, name).name])
+    monkeypatch.setattr(server, "BATCH_COLLECTIONS", {
+        name: (db[collection.name], model) for name, (collection, model) in server.BATCH_COLLECTIONS.items()
+    })
+
+    async def ensure_indexes():
+        for collection, indexes in server.INDEXES.items():
+            for index in indexes:
+                try:
+                    await db[collection.name].create_indexes([index])
+                except NotImplementedError:
+                    pass  # text indexes
+
+    async def explain_hot_queries():
+        return []
+
+    async def watch_change_stream():
+        raise OperationFailure("not a replica set", code=40573)
+
+    monkeypatch.setattr(server, "ensure_indexes", ensure_indexes)
+    monkeypatch.setattr(server, "explain_hot_queries", explain_hot_queries)
+    monkeypatch.setattr(server, "watch_change_stream", watch_change_stream)
+    # Per-process state must not leak between tests (or event loops)
+    monkeypatch.setattr(server, "metadata_caches", type(server.metadata_caches)())
+    monkeypatch.setattr(server, "version_cache", server.TTLCache(server.TENANT_CACHE_SIZE, server.CHANGE_POLL_INTERVAL))
+    monkeypatch.setattr(server, "insights_cache", server.TTLCache(server.INSIGHTS_CACHE_SIZE, server.INSIGHTS_CACHE_TTL))
+    monkeypatch.setattr(server, "anomaly_detector", server.AnomalyDetector())
+    monkeypatch.setattr(server, "live_dashboards", {})
+    monkeypatch.setattr(server, "insights_queue", asyncio.Queue(maxsize=server.INSIGHTS_QUEUE_SIZE))
+    monkeypatch.setattr(server, "llm_semaphore", asyncio.Semaphore(server.LLM_MAX_CONCURRENCY))
+
+    with TestClient(server.app) as client:
+        client.db = db
+        yield client
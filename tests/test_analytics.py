@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+import analytics
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(7)
+    amounts = rng.gamma(2.0, 30.0, 500).round(2)
+    category_ids = rng.choice(["food", "rent", "travel"], 500).tolist()
+    dates = np.datetime64("2024-01-01") + rng.integers(0, 120, 500)
+    return analytics.ExpenseFrame(amounts, category_ids, dates.astype("datetime64[ms]"))
+
+
+def test_category_totals(frame):
+    totals = analytics.category_totals(frame)
+    for category_id, total in totals.items():
+        expected = frame.amount[frame.categories[frame.category] == category_id].sum()
+        assert total == pytest.approx(expected)
+
+
+def test_category_percentiles_match_linear_interpolation(frame):
+    result = analytics.category_percentiles(frame)
+    assert set(result) == {"food", "rent", "travel"}
+    for category_id, quantiles in result.items():
+        amounts = frame.amount[frame.categories[frame.category] == category_id]
+        assert quantiles == pytest.approx({
+            "p50": np.percentile(amounts, 50),
+            "p90": np.percentile(amounts, 90),
+            "p99": np.percentile(amounts, 99)
+        })
+
+
+def test_category_percentiles_interpolates_between_ranks():
+    frame = analytics.ExpenseFrame([40, 10, 20, 30, 5], ["a", "a", "a", "a", "b"], np.array(["2024-01-01"] * 5, dtype="datetime64[ms]"))
+    result = analytics.category_percentiles(frame, quantiles=(0.5, 0.9))
+    # a sorted: 10 20 30 40 -> p50 at rank 1.5, p90 at rank 2.7
+    assert result["a"] == pytest.approx({"p50": 25.0, "p90": 37.0})
+    assert result["b"] == {"p50": 5.0, "p90": 5.0}
+
+
+def test_category_percentiles_empty():
+    frame = analytics.ExpenseFrame([], [], np.array([], dtype="datetime64[ms]"))
+    assert analytics.category_percentiles(frame) == {}
+
+
+def test_frame_from_groups_matches_rows(frame):
+    keys = sorted({(frame.categories[c], str(frame.months[m])) for c, m in zip(frame.category, frame.month)})
+    groups = [
+        frame.amount[(frame.categories[frame.category] == cat_id) & (frame.months[frame.month].astype(str) == month)]
+        for cat_id, month in keys
+    ]
+    grouped = analytics.ExpenseFrame.from_groups(groups, [k[0] for k in keys], [k[1] for k in keys])
+    assert grouped.categories.tolist() == frame.categories.tolist()
+    assert grouped.months.tolist() == frame.months.tolist()
+    assert analytics.category_totals(grouped) == pytest.approx(analytics.category_totals(frame))
+    trends, expected = analytics.monthly_trends(grouped), analytics.monthly_trends(frame)
+    assert [t["month"] for t in trends] == [t["month"] for t in expected]
+    assert [t["amount"] for t in trends] == pytest.approx([t["amount"] for t in expected])
+    assert analytics.category_percentiles(grouped) == analytics.category_percentiles(frame)
+
+
+def test_detailed_analytics_loads_the_tenants_expenses(api):
+    api.post("/api/categories", json={"id": "food", "name": "Food"})
+    for amount, date in ((10, "2026-08-03"), (30, "2026-08-20"), (5, "2026-09-01")):
+        api.post("/api/expenses", json={"amount": amount, "category_id": "food", "description": "x", "date": date})
+    api.post("/api/categories", json={"id": "food", "name": "Other"}, headers={"X-User-Id": "bob"})
+    api.post("/api/expenses", json={"amount": 999, "category_id": "food", "description": "x", "date": "2026-08-03"}, headers={"X-User-Id": "bob"})
+
+    body = api.get("/api/analytics/detailed").json()
+    assert [(row["category"], row["amount"], row["p50"]) for row in body["category_spending"]] == [("Food", 45.0, 10.0)]
+    assert [(row["month"], row["amount"]) for row in body["monthly_trends"]] == [("2026-08", 40.0), ("2026-09", 5.0)]
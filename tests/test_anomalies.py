@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+import analytics
+
+WINDOW = 20
+MIN_HISTORY = 5
+DAYS = 7
+
+
+@pytest.fixture
+def history():
+    rng = np.random.default_rng(3)
+    category_ids = rng.choice(["food", "rent", "travel"], 400).tolist()
+    amounts = rng.gamma(3.0, 20.0, 400).round(2)
+    amounts[rng.choice(400, 12, replace=False)] *= 15
+    return category_ids, amounts
+
+
+def test_incremental_and_batch_amount_detectors_agree(history):
+    category_ids, amounts = history
+    scores, medians, flagged = analytics.amount_outliers(category_ids, amounts, WINDOW, MIN_HISTORY, 3.5)
+
+    windows = {}
+    for i, (category_id, amount) in enumerate(zip(category_ids, amounts.tolist())):
+        window = windows.setdefault(category_id, analytics.CategoryWindow(WINDOW, DAYS))
+        score, median = window.amount_score(amount)
+        if median is None:
+            assert np.isnan(medians[i])
+        else:
+            assert median == pytest.approx(medians[i])
+            assert score == pytest.approx(scores[i])
+        assert (len(window.amounts) >= MIN_HISTORY and score > 3.5) == flagged[i]
+        window.push(amount)
+    assert flagged.any()
+
+
+def test_amount_outliers_needs_history():
+    amounts = [10, 10, 10, 500]
+    _, _, flagged = analytics.amount_outliers(["a"] * 4, amounts, 10, 3, 3.5)
+    assert flagged.tolist() == [False, False, False, True]
+    _, _, flagged = analytics.amount_outliers(["a"] * 4, amounts, 10, 4, 3.5)
+    assert not flagged.any()
+
+
+def test_amount_outliers_scores_per_category():
+    _, medians, flagged = analytics.amount_outliers(["a", "b", "a", "b", "a"], [10, 1000, 10, 1000, 12], 10, 2, 3.5)
+    assert medians[4] == 10
+    assert not flagged.any()
+
+
+def test_sliding_median_drops_old_values():
+    median = analytics.SlidingMedian(3)
+    for value in [1, 100, 2, 3]:
+        median.push(value)
+    assert len(median) == 3
+    assert median.median() == 3
+
+
+def test_duplicate_of():
+    originals = analytics.duplicate_of(
+        [10.0, 10.0, 10.0, 10.0, 20.0],
+        ["Coffee", " coffee ", "Coffee", None, "Coffee"],
+        ["2024-01-01", "2024-01-01", "2024-01-02", "2024-01-01", "2024-01-01"]
+    )
+    assert originals.tolist() == [-1, 0, -1, -1, -1]
+
+
+def test_duplicate_of_separates_owners():
+    originals = analytics.duplicate_of(
+        [5.0, 5.0, 5.0], ["Taxi"] * 3, ["2024-01-01"] * 3, owners=["u1", "u2", "u1"]
+    )
+    assert originals.tolist() == [-1, -1, 0]
+
+
+def test_velocity_jumps():
+    rollups = [{"day": f"2024-01-{d:02d}", "category_id": "food", "sum": 10.0, "count": 1} for d in range(1, 10)]
+    rollups.append({"day": "2024-01-10", "category_id": "food", "sum": 50.0, "count": 1})
+    rollups.append({"day": "2024-01-05", "category_id": "rent", "sum": 900.0, "count": 1})
+    assert analytics.velocity_jumps(rollups, DAYS, 3.0, 5) == [("2024-01-10", "food", 50.0, 10.0)]
+    # The same jump before a full window of history is ignored
+    assert analytics.velocity_jumps(rollups[3:], DAYS, 3.0, 5) == []
+
+
+def test_incremental_and_batch_velocity_detectors_agree():
+    rng = np.random.default_rng(5)
+    days = np.sort(rng.integers(0, 60, 300))
+    category_ids = rng.choice(["food", "travel"], 300)
+    amounts = rng.gamma(2.0, 10.0, 300).round(2)
+    amounts[rng.choice(300, 5, replace=False)] *= 40
+
+    first = np.datetime64("2024-01-01")
+    totals = {}
+    for day, category_id, amount in zip(days.tolist(), category_ids.tolist(), amounts.tolist()):
+        rollup = totals.setdefault((day, category_id), {"day": str(first + day), "category_id": category_id, "sum": 0.0, "count": 0})
+        rollup["sum"] += amount
+        rollup["count"] += 1
+    jumps = analytics.velocity_jumps(list(totals.values()), DAYS, 3.0, MIN_HISTORY)
+    assert jumps
+
+    windows = {}
+    seen = {}
+    incremental = []
+    for day, category_id, amount in zip(days.tolist(), category_ids.tolist(), amounts.tolist()):
+        window = windows.setdefault(category_id, analytics.CategoryWindow(WINDOW, DAYS))
+        _, after, baseline = window.add_to_day(day, amount)
+        seen[category_id] = seen.get(category_id, 0) + 1
+        rollup = totals[(day, category_id)]
+        history = seen[category_id] - rollup["count"]  # expenses on earlier days
+        # Compare once the day is complete, as the batch detector sees it
+        if baseline and after == pytest.approx(rollup["sum"]) and history >= MIN_HISTORY:
+            if rollup["sum"] > 3.0 * baseline:
+                incremental.append((rollup["day"], category_id, rollup["sum"], baseline))
+    assert [(d, c) for d, c, _, _ in incremental] == [(d, c) for d, c, _, _ in jumps]
+    for (_, _, _, expected), (_, _, _, actual) in zip(jumps, incremental):
+        assert actual == pytest.approx(expected)
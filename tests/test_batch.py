@@ -0,0 +1,137 @@
+from contextlib import asynccontextmanager
+
+import pytest
+from pymongo.errors import OperationFailure
+
+import server
+
+MONTH = "2026-09"
+
+
+class FakeSession:
+    """Stands in for a client session; aborting restores a snapshot of the database."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __bool__(self):
+        return False  # mongomock refuses real sessions
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @asynccontextmanager
+    async def start_transaction(self):
+        names = await self.db.list_collection_names()
+        snapshot = {name: await self.db[name].find().to_list(length=None) for name in names}
+        try:
+            yield
+        except BaseException:
+            for name in await self.db.list_collection_names():
+                await self.db[name].delete_many({})
+                if snapshot.get(name):
+                    await self.db[name].insert_many(snapshot[name])
+            raise
+
+
+@pytest.fixture
+def transactions(api, monkeypatch):
+    async def start_session():
+        return FakeSession(api.db)
+    monkeypatch.setattr(server.client, "start_session", start_session)
+
+
+def seed(api):
+    api.post("/api/categories", json={"id": "rent", "name": "Rent"})
+    api.post("/api/categories", json={"id": "food", "name": "Food"})
+    api.post("/api/budgets", json={"id": "rent-budget", "category_id": "rent", "amount": 1000})
+    for day, amount in ((1, 10.0), (2, 30.0)):
+        response = api.post("/api/expenses", json={"id": f"food-{day}", "amount": amount, "category_id": "food", "description": "Lunch", "date": f"{MONTH}-0{day}"})
+        assert response.status_code == 200
+
+
+def rollups(api):
+    docs = api.portal.call(lambda: api.db.monthly_rollups.find({}, {"_id": 0, "user_id": 0}).to_list(length=None))
+    return {doc["category_id"]: (doc["sum"], doc["count"], doc["min"], doc["max"]) for doc in docs}
+
+
+def statuses(response):
+    return [result["status"] for result in response.json()["results"]]
+
+
+def test_batch_applies_each_operation_and_reports_per_item(api):
+    seed(api)
+    response = api.post("/api/batch", json={"operations": [
+        {"op": "create", "collection": "categories", "data": {"id": "gym", "name": "Gym"}},
+        {"op": "create", "collection": "expenses", "data": {"id": "gym-1", "amount": 40, "category_id": "gym", "description": "Pass", "date": f"{MONTH}-03"}},
+        {"op": "create", "collection": "expenses", "data": {"amount": 5, "category_id": "missing", "description": "x", "date": f"{MONTH}-03"}},
+        {"op": "update", "collection": "expenses", "id": "food-2", "data": {"amount": 20, "category_id": "food", "description": "Lunch", "date": f"{MONTH}-02"}},
+        {"op": "delete", "collection": "expenses", "id": "nope"},
+        {"op": "delete", "collection": "categories", "id": "food"},
+    ]})
+    assert response.status_code == 200
+    assert statuses(response) == ["ok", "ok", "error", "ok", "error", "error"]
+    assert response.json()["results"][5]["detail"] == "Cannot delete category with 2 expenses"
+    assert response.json()["succeeded"] == 3
+    assert rollups(api) == {"food": (30.0, 2, 10.0, 20.0), "gym": (40.0, 1, 40.0, 40.0)}
+
+
+def test_deleting_a_category_invalidates_budget_etags(api):
+    seed(api)
+    before = api.get("/api/budgets")
+    assert [b["id"] for b in before.json()] == ["rent-budget"]
+
+    response = api.post("/api/batch", json={"operations": [{"op": "delete", "collection": "categories", "id": "rent"}]})
+    assert statuses(response) == ["ok"]
+
+    after = api.get("/api/budgets", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.json() == []
+
+
+def test_transaction_rejects_an_invalid_batch_without_writing(api, transactions):
+    seed(api)
+    response = api.post("/api/batch", json={"transaction": True, "operations": [
+        {"op": "create", "collection": "expenses", "data": {"amount": 5, "category_id": "food", "description": "x", "date": f"{MONTH}-03"}},
+        {"op": "delete", "collection": "budgets", "id": "nope"},
+    ]})
+    assert response.status_code == 400
+    assert response.json()["detail"]["message"] == "Batch rejected, nothing was written"
+    assert [r["status"] for r in response.json()["detail"]["results"]] == ["rolled_back", "error"]
+    assert len(api.get("/api/expenses").json()) == 2
+
+
+def test_transaction_rolls_back_on_a_write_error(api, transactions):
+    seed(api)
+    response = api.post("/api/batch", json={"transaction": True, "operations": [
+        {"op": "delete", "collection": "expenses", "id": "food-1"},
+        {"op": "create", "collection": "budgets", "data": {"category_id": "rent", "amount": 5}},
+    ]})
+    assert response.status_code == 400
+    assert response.json()["detail"]["message"] == "Batch rolled back"
+    assert [r["status"] for r in response.json()["detail"]["results"]] == ["rolled_back", "error"]
+    assert sorted(e["id"] for e in api.get("/api/expenses").json()) == ["food-1", "food-2"]
+    assert rollups(api) == {"food": (40.0, 2, 10.0, 30.0)}
+
+
+def test_transaction_commits_and_updates_rollups(api, transactions):
+    seed(api)
+    response = api.post("/api/batch", json={"transaction": True, "operations": [
+        {"op": "delete", "collection": "expenses", "id": "food-1"},
+        {"op": "create", "collection": "expenses", "data": {"amount": 50, "category_id": "food", "description": "Dinner", "date": f"{MONTH}-04"}},
+    ]})
+    assert statuses(response) == ["ok", "ok"]
+    assert rollups(api) == {"food": (80.0, 2, 30.0, 50.0)}
+
+
+def test_transaction_needs_a_replica_set(api, monkeypatch):
+    async def start_session():
+        raise OperationFailure("Transaction numbers are only allowed on a replica set member or mongos", code=20)
+    monkeypatch.setattr(server.client, "start_session", start_session)
+    seed(api)
+    response = api.post("/api/batch", json={"transaction": True, "operations": [{"op": "delete", "collection": "expenses", "id": "food-1"}]})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Transactions require a replica set or sharded cluster"
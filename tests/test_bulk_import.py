@@ -0,0 +1,85 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+CSV = "text/csv"
+NDJSON = "application/x-ndjson"
+
+
+def test_parse_csv_rows():
+    body = "\ufeffid,amount,category_id,description,date\n,12.5,food,Lunch,2026-10-01\n".encode()
+    assert server.parse_bulk_rows(body, CSV) == [
+        {"id": "", "amount": "12.5", "category_id": "food", "description": "Lunch", "date": "2026-10-01"}
+    ]
+
+
+def test_parse_ndjson_keeps_bad_lines_as_errors():
+    body = b'{"amount": 1}\n\nnot json\n{"amount": 2}\n'
+    rows = server.parse_bulk_rows(body, NDJSON)
+    assert rows[0] == {"amount": 1} and rows[2] == {"amount": 2}
+    assert rows[1].startswith("Invalid JSON")
+
+
+@pytest.mark.parametrize("body", [b"[1,", b'{"amount": 1}'])
+def test_parse_json_needs_an_array(body):
+    with pytest.raises(HTTPException) as error:
+        server.parse_bulk_rows(body, "application/json")
+    assert error.value.status_code == 400
+
+
+def test_validate_rows():
+    rows = [
+        {"amount": "12.5", "category_id": "food", "description": "Lunch", "date": "2026-10-01"},
+        {"id": "mine", "amount": 3, "category_id": "food", "description": "Tea", "date": "2026-10-02T09:30:00+02:00"},
+        {"amount": "lots", "category_id": "food", "description": "x", "date": "2026-10-01"},
+        {"amount": 1, "category_id": "rent", "description": "x", "date": "2026-10-01"},
+        {"amount": 1, "category_id": "food", "description": "x", "date": "yesterday"},
+        "Invalid JSON: Expecting value",
+        [1, 2],
+    ]
+    valid, errors = server.validate_bulk_rows(rows, {"food"}, "alice")
+    assert [row for row, _ in valid] == [0, 1]
+    first, second = valid[0][1], valid[1][1]
+    assert first["amount"] == 12.5 and first["user_id"] == "alice" and first["id"]
+    assert first["date"] == datetime(2026, 10, 1, tzinfo=timezone.utc)
+    assert second["id"] == "mine"
+    assert second["date"] == datetime(2026, 10, 2, 7, 30, tzinfo=timezone.utc)
+    assert first["created_at"] == second["created_at"]
+    assert [error["row"] for error in errors] == [2, 3, 4, 5, 6]
+    assert errors[1]["detail"] == "Category not found"
+    assert errors[4]["detail"] == "Expected an object"
+
+
+def test_blank_csv_ids_get_generated():
+    rows = [
+        {"id": "", "amount": "1", "category_id": "food", "description": "a", "date": "2026-10-01", "created_at": ""},
+        {"id": "", "amount": "2", "category_id": "food", "description": "b", "date": "2026-10-01", "created_at": ""},
+    ]
+    valid, errors = server.validate_bulk_rows(rows, {"food"}, "alice")
+    assert errors == []
+    ids = [doc["id"] for _, doc in valid]
+    assert all(ids) and ids[0] != ids[1]
+    assert all(doc["created_at"] for _, doc in valid)
+
+
+def test_bulk_import_csv_with_an_id_column(api):
+    api.post("/api/categories", json={"id": "food", "name": "Food"})
+    body = "id,amount,category_id,description,date\n" + "".join(
+        f",{amount},food,Lunch {amount},2026-10-0{amount}\n" for amount in range(1, 4)
+    )
+    response = api.post("/api/expenses/bulk", content=body, headers={"Content-Type": CSV})
+    assert response.json() == {"inserted": 3, "failed": 0, "errors": []}
+    assert len({expense["id"] for expense in api.get("/api/expenses").json()}) == 3
+
+
+def test_bulk_import_reports_duplicate_ids(api):
+    api.post("/api/categories", json={"id": "food", "name": "Food"})
+    rows = [{"id": "same", "amount": amount, "category_id": "food", "description": "x", "date": "2026-10-01"} for amount in (1, 2)]
+    response = api.post("/api/expenses/bulk", content="\n".join(map(json.dumps, rows)), headers={"Content-Type": NDJSON})
+    body = response.json()
+    assert body["inserted"] == 1 and body["failed"] == 1
+    assert body["errors"][0]["row"] == 1
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_concurrent_loads_share_one_call():
+    cache = server.TTLCache(maxsize=10, ttl=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"value": len(calls)}
+
+    async def main():
+        results = await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(20)))
+        assert all(result is results[0] for result in results)
+        assert await cache.get_or_load("key", loader) is results[0]
+
+    run(main())
+    assert len(calls) == 1
+
+
+def test_failed_load_is_not_cached():
+    cache = server.TTLCache(maxsize=10, ttl=60)
+    attempts = []
+
+    async def loader():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("database unavailable")
+        return "loaded"
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await cache.get_or_load("key", loader)
+        assert cache.get("key") is None
+        assert await cache.get_or_load("key", loader) == "loaded"
+
+    run(main())
+    assert len(attempts) == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_load():
+    cache = server.TTLCache(maxsize=10, ttl=60)
+
+    async def loader():
+        await asyncio.sleep(0.02)
+        return "loaded"
+
+    async def main():
+        waiter = asyncio.ensure_future(cache.get_or_load("key", loader))
+        other = asyncio.ensure_future(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        assert await other == "loaded"
+
+    run(main())
+    assert cache.get("key") == "loaded"
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    cache = server.TTLCache(maxsize=10, ttl=30)
+    cache.set("key", "value")
+    now[0] += 29
+    assert cache.get("key") == "value"
+    now[0] += 1
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = server.TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_discard():
+    cache = server.TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.discard("a")
+    cache.discard("missing")
+    assert cache.get("a") is None
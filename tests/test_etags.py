@@ -0,0 +1,33 @@
+import server
+
+
+def metadata_version():
+    """Bumped on every reload of (or write through) the default tenant's metadata."""
+    return server.metadata_for(server.DEFAULT_USER_ID).version
+
+
+def test_expense_writes_keep_the_metadata_cache(api):
+    api.post("/api/categories", json={"id": "food", "name": "Food"})
+    api.post("/api/budgets", json={"category_id": "food", "amount": 100})
+    first = api.get("/api/budgets")
+    version = metadata_version()
+
+    api.post("/api/expenses", json={"amount": 5, "category_id": "food", "description": "x", "date": "2026-10-01"})
+    assert api.get("/api/budgets", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert api.get("/api/categories").status_code == 200
+    assert metadata_version() == version
+
+
+def test_another_workers_budget_write_reloads_the_metadata(api):
+    api.post("/api/categories", json={"id": "food", "name": "Food"})
+    first = api.get("/api/budgets")
+    assert first.json() == []
+
+    async def write_elsewhere():
+        await server.budgets_collection.insert_one({"id": "b1", "user_id": server.DEFAULT_USER_ID, "category_id": "food", "amount": 50.0})
+        await server.bump_data_version(server.budgets_collection.name, server.DEFAULT_USER_ID)
+    api.portal.call(write_elsewhere)
+
+    again = api.get("/api/budgets", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 200
+    assert [budget["id"] for budget in again.json()] == ["b1"]
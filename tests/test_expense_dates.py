@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def test_date_only_range_includes_the_whole_last_day():
+    assert server.date_range_filter("2024-01-01", "2024-01-31") == {"date": {
+        "$gte": datetime(2024, 1, 1, tzinfo=timezone.utc),
+        "$lt": datetime(2024, 2, 1, tzinfo=timezone.utc)
+    }}
+
+
+def test_timestamp_range_is_inclusive():
+    end = datetime(2024, 1, 31, 12, tzinfo=timezone.utc)
+    assert server.date_range_filter(None, "2024-01-31T14:00:00+02:00") == {"date": {"$lte": end}}
+    assert server.date_range_filter(None, end.isoformat())["date"]["$lte"] == end
+
+
+def test_unbounded_range():
+    assert server.date_range_filter(None, None) == {}
+    assert server.date_range_filter("", "") == {}
+
+
+@pytest.mark.parametrize("date_from, date_to", [("yesterday", None), (None, "2024-13-01")])
+def test_invalid_range(date_from, date_to):
+    with pytest.raises(HTTPException) as error:
+        server.date_range_filter(date_from, date_to)
+    assert error.value.status_code == 400
+
+
+def test_parse_expense_date_is_utc():
+    assert server.parse_expense_date("2024-06-01") == datetime(2024, 6, 1, tzinfo=timezone.utc)
+    assert server.parse_expense_date("2024-06-01T02:00:00+02:00") == datetime(2024, 6, 1, tzinfo=timezone.utc)
+    assert server.parse_expense_date("2024-06-01T00:00:00") - server.parse_expense_date("2024-05-31") == timedelta(days=1)
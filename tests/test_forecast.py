@@ -0,0 +1,45 @@
+import numpy as np
+
+import analytics
+
+
+def test_pace_forecast_breach_day():
+    # 10/day for 5 days, then 10/day projected: cumulative 10, 20, ... crosses 75 on day 8
+    series = np.full((5, 2), 10.0)
+    spent, projected, breach_day = analytics.month_forecast(series, 30, np.array([75.0, 1000.0]), "pace")
+    assert spent.tolist() == [50.0, 50.0]
+    assert projected.tolist() == [300.0, 300.0]
+    assert breach_day.tolist() == [8, 0]
+
+
+def test_breach_already_happened():
+    series = np.array([[5.0], [50.0], [5.0]])
+    _, _, breach_day = analytics.month_forecast(series, 31, np.array([40.0]), "pace")
+    assert breach_day.tolist() == [2]
+
+
+def test_spend_equal_to_budget_is_not_a_breach():
+    series = np.full((10, 1), 10.0)
+    _, projected, breach_day = analytics.month_forecast(series, 10, np.array([100.0]), "pace")
+    assert projected.tolist() == [100.0]
+    assert breach_day.tolist() == [0]
+
+
+def test_no_budget_never_breaches():
+    series = np.full((3, 1), 100.0)
+    _, _, breach_day = analytics.month_forecast(series, 30, np.array([np.nan]), "pace")
+    assert breach_day.tolist() == [0]
+
+
+def test_month_already_over():
+    series = np.arange(1.0, 31.0)[:, None]
+    spent, projected, _ = analytics.month_forecast(series, 30, np.array([np.nan]))
+    assert spent.tolist() == projected.tolist() == [465.0]
+
+
+def test_smoothing_follows_a_linear_trend():
+    series = np.arange(1.0, 11.0)[:, None]
+    _, projected, _ = analytics.month_forecast(series, 12, np.array([np.nan]), "smoothing")
+    _, pace, _ = analytics.month_forecast(series, 12, np.array([np.nan]), "pace")
+    # Holt's method extends the trend, the pace forecast only the average
+    assert projected[0] > pace[0] == 55.0 + 2 * 5.5
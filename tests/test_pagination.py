@@ -0,0 +1,22 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def test_cursor_roundtrip():
+    date = datetime(2024, 3, 5, 14, 30, tzinfo=timezone.utc)
+    cursor = server.encode_cursor({"date": date, "id": "abc"})
+    assert server.decode_cursor(cursor) == {"$or": [
+        {"date": {"$lt": date}},
+        {"date": date, "id": {"$lt": "abc"}}
+    ]}
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "", "WzFd", "WyJ4IiwgIjEiXQ=="])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as error:
+        server.decode_cursor(cursor)
+    assert error.value.status_code == 400
@@ -0,0 +1,112 @@
+import server
+
+
+def add(api, expense_id, amount, category_id="food", date="2026-09-10"):
+    expense = {"id": expense_id, "amount": amount, "category_id": category_id, "description": expense_id, "date": date}
+    assert api.post("/api/expenses", json=expense).status_code == 200
+    return expense
+
+
+def monthly(api):
+    docs = api.portal.call(lambda: server.rollups_collection.find({}, {"_id": 0}).to_list(length=None))
+    return {(doc["month"], doc["category_id"]): (doc["sum"], doc["count"], doc["min"], doc["max"]) for doc in docs}
+
+
+def daily(api):
+    docs = api.portal.call(lambda: server.daily_rollups_collection.find({}, {"_id": 0}).to_list(length=None))
+    return {(doc["day"], doc["category_id"]): (doc["sum"], doc["count"]) for doc in docs}
+
+
+def rebuilt(api):
+    """The rollups recomputed from scratch from the expenses."""
+    expenses = api.portal.call(lambda: server.expenses_collection.find({}, {"_id": 0}).to_list(length=None))
+    months, days = {}, {}
+    for expense in expenses:
+        amount = expense["amount"]
+        key = (server.expense_month(expense), expense["category_id"])
+        total, count, low, high = months.get(key, (0, 0, amount, amount))
+        months[key] = (total + amount, count + 1, min(low, amount), max(high, amount))
+        key = (server.expense_day(expense), expense["category_id"])
+        total, count = days.get(key, (0, 0))
+        days[key] = (total + amount, count + 1)
+    return months, days
+
+
+def assert_consistent(api):
+    assert (monthly(api), daily(api)) == rebuilt(api)
+
+
+def setup_categories(api):
+    for category_id in ("food", "rent"):
+        api.post("/api/categories", json={"id": category_id, "name": category_id.title()})
+
+
+def test_create_adds_to_month_and_day(api):
+    setup_categories(api)
+    add(api, "a", 10.0)
+    add(api, "b", 25.0)
+    add(api, "c", 5.0, date="2026-09-11")
+    assert monthly(api) == {("2026-09", "food"): (40.0, 3, 5.0, 25.0)}
+    assert daily(api) == {("2026-09-10", "food"): (35.0, 2), ("2026-09-11", "food"): (5.0, 1)}
+
+
+def test_deleting_the_extremes_rederives_min_and_max(api):
+    setup_categories(api)
+    for expense_id, amount in (("low", 5.0), ("mid", 10.0), ("high", 50.0)):
+        add(api, expense_id, amount)
+    api.delete("/api/expenses/high")
+    assert monthly(api) == {("2026-09", "food"): (15.0, 2, 5.0, 10.0)}
+    api.delete("/api/expenses/low")
+    assert monthly(api) == {("2026-09", "food"): (10.0, 1, 10.0, 10.0)}
+    assert_consistent(api)
+
+
+def test_deleting_the_last_expense_drops_the_buckets(api):
+    setup_categories(api)
+    add(api, "a", 10.0)
+    add(api, "b", 20.0, date="2026-09-11")
+    api.delete("/api/expenses/a")
+    assert ("2026-09-10", "food") not in daily(api)
+    api.delete("/api/expenses/b")
+    assert monthly(api) == {}
+    assert daily(api) == {}
+
+
+def test_update_moves_the_amount_between_buckets(api):
+    setup_categories(api)
+    add(api, "a", 10.0)
+    add(api, "b", 40.0)
+    moved = {"id": "b", "amount": 60.0, "category_id": "rent", "description": "b", "date": "2026-10-01"}
+    assert api.put("/api/expenses/b", json=moved).status_code == 200
+    assert monthly(api) == {
+        ("2026-09", "food"): (10.0, 1, 10.0, 10.0),
+        ("2026-10", "rent"): (60.0, 1, 60.0, 60.0)
+    }
+    assert daily(api) == {("2026-09-10", "food"): (10.0, 1), ("2026-10-01", "rent"): (60.0, 1)}
+
+
+def test_update_within_a_bucket_keeps_it_consistent(api):
+    setup_categories(api)
+    add(api, "a", 10.0)
+    add(api, "b", 40.0)
+    lowered = {"id": "b", "amount": 15.0, "category_id": "food", "description": "b", "date": "2026-09-10"}
+    api.put("/api/expenses/b", json=lowered)
+    assert monthly(api) == {("2026-09", "food"): (25.0, 2, 10.0, 15.0)}
+    assert_consistent(api)
+
+
+def test_batch_replacements_match_a_rebuild(api):
+    setup_categories(api)
+    for i, amount in enumerate((5.0, 10.0, 20.0, 80.0)):
+        add(api, f"e{i}", amount, date=f"2026-09-1{i}")
+    api.post("/api/batch", json={"operations": [
+        {"op": "delete", "collection": "expenses", "id": "e3"},
+        {"op": "delete", "collection": "expenses", "id": "e0"},
+        {"op": "update", "collection": "expenses", "id": "e1", "data": {"amount": 12.0, "category_id": "rent", "description": "e1", "date": "2026-08-31"}},
+        {"op": "create", "collection": "expenses", "data": {"amount": 7.0, "category_id": "food", "description": "new", "date": "2026-09-12"}},
+    ]})
+    assert monthly(api) == {
+        ("2026-08", "rent"): (12.0, 1, 12.0, 12.0),
+        ("2026-09", "food"): (27.0, 2, 7.0, 20.0)
+    }
+    assert_consistent(api)
@@ -0,0 +1,27 @@
+ALICE = {"X-User-Id": "alice"}
+BOB = {"X-User-Id": "bob"}
+
+
+def seed_tenants(api):
+    """Both tenants own a category with the same id; only alice has expenses."""
+    assert api.post("/api/categories", json={"id": "food", "name": "Alice Food"}, headers=ALICE).status_code == 200
+    assert api.post("/api/categories", json={"id": "food", "name": "Bob Secret"}, headers=BOB).status_code == 200
+    expense = {"amount": 12.5, "category_id": "food", "description": "Lunch", "date": "2026-10-01"}
+    response = api.post("/api/expenses", json=expense, headers=ALICE)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_dashboard_joins_only_the_tenants_categories(api):
+    expense = seed_tenants(api)
+    recent = api.get("/api/dashboard?from=2026-10-01&to=2026-10-31", headers=ALICE).json()["recent_transactions"]
+    assert [(t["id"], t["category_name"]) for t in recent] == [(expense["id"], "Alice Food")]
+    assert api.get("/api/dashboard?from=2026-10-01&to=2026-10-31", headers=BOB).json()["recent_transactions"] == []
+
+
+def test_tenants_share_ids_but_not_documents(api):
+    expense = seed_tenants(api)
+    assert [c["name"] for c in api.get("/api/categories", headers=BOB).json()] == ["Bob Secret"]
+    assert api.get("/api/expenses", headers=BOB).json() == []
+    assert api.delete(f"/api/expenses/{expense['id']}", headers=BOB).status_code == 404
+    assert [e["id"] for e in api.get("/api/expenses", headers=ALICE).json()] == [expense["id"]]